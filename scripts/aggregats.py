@@ -0,0 +1,232 @@
+import sys
+import mysql.connector
+
+from commun import log_etl
+from commun import MYSQL_CONF
+from commun import DATA_LOG
+from result_cache import bump_generation
+
+#---------------
+# CONFIGURATION
+#---------------
+
+# Agrégats maintenus par load : chaque chargement calcule les deltas des lignes
+# qu'il vient d'insérer (produit, jour, production, commandes) dans une table
+# temporaire, puis les reporte dans les agrégats, dans la même transaction que
+# les données, au lieu de recalculer les sommes sur tout l'historique à chaque lecture.
+#  ▪︎ stock_courant : cumuls par produit
+#  ▪︎ stock_journal : mouvements du jour et soldes cumulés par produit et par jour
+#  ▪︎ ventes_jour / commandes_jour : cube des ventes par jour, revendeur (et produit)
+
+SQL_DELTAS_TABLE = """
+CREATE TEMPORARY TABLE IF NOT EXISTS stg_stock_delta (
+    id_pdt INT NOT NULL,
+    jour date NOT NULL,
+    prod BIGINT NOT NULL,
+    cmds BIGINT NOT NULL,
+    PRIMARY KEY (id_pdt, jour)
+) ENGINE=InnoDB;
+"""
+
+# commandes : lignes rattachées aux commandes créées par ce chargement (id > max_id_before)
+SQL_DELTAS_CMDS = """
+INSERT INTO stg_stock_delta (id_pdt, jour, prod, cmds)
+SELECT lc.id_pdt, c.date, 0, SUM(lc.quantite)
+FROM commandes AS c
+JOIN lignes_cmd AS lc ON lc.id_cmd = c.id
+WHERE c.id > %s
+GROUP BY lc.id_pdt, c.date;
+"""
+
+# production : lignes du staging absentes de production (exécuté avant leur insertion) ;
+# id_src résolu comme dans load (un seul produits.id par id_src, même avec des doublons)
+SQL_DELTAS_PROD = """
+INSERT INTO stg_stock_delta (id_pdt, jour, prod, cmds)
+SELECT p.id, s.date, SUM(s.quantite), 0
+FROM stg_production AS s
+JOIN (SELECT id_src, MIN(id) AS id FROM produits GROUP BY id_src) AS p ON p.id_src = s.id_pdt
+LEFT JOIN production AS x ON x.id = s.id
+WHERE x.id IS NULL
+GROUP BY p.id, s.date;
+"""
+
+# ventes des commandes créées par ce chargement (id > %s ; 0 pour un recalcul complet)
+SQL_SALES_DELTAS = [
+    """
+    INSERT INTO ventes_jour (jour, id_revendeur, id_pdt, quantite, chiffre_affaires, nb_commandes)
+    SELECT * FROM (
+        SELECT c.date AS jour, c.id_revendeur, lc.id_pdt,
+            SUM(lc.quantite) AS quantite,
+            SUM(lc.quantite * lc.prix_unitaire) AS chiffre_affaires,
+            COUNT(DISTINCT c.id) AS nb_commandes
+        FROM commandes AS c
+        JOIN lignes_cmd AS lc ON lc.id_cmd = c.id
+        WHERE c.id > %s
+        GROUP BY c.date, c.id_revendeur, lc.id_pdt
+    ) AS delta
+    ON DUPLICATE KEY UPDATE
+        quantite = ventes_jour.quantite + delta.quantite,
+        chiffre_affaires = ventes_jour.chiffre_affaires + delta.chiffre_affaires,
+        nb_commandes = ventes_jour.nb_commandes + delta.nb_commandes;
+    """,
+    """
+    INSERT INTO commandes_jour (jour, id_revendeur, nb_commandes)
+    SELECT * FROM (
+        SELECT c.date AS jour, c.id_revendeur, COUNT(DISTINCT c.id) AS nb_commandes
+        FROM commandes AS c
+        JOIN lignes_cmd AS lc ON lc.id_cmd = c.id
+        WHERE c.id > %s
+        GROUP BY c.date, c.id_revendeur
+    ) AS delta
+    ON DUPLICATE KEY UPDATE nb_commandes = commandes_jour.nb_commandes + delta.nb_commandes;
+    """,
+]
+
+SQL_APPLY_DELTAS = [
+    # stock courant
+    """
+    INSERT INTO stock_courant (id_pdt, total_prod, total_cmds)
+    SELECT * FROM (
+        SELECT id_pdt, SUM(prod) AS total_prod, SUM(cmds) AS total_cmds
+        FROM stg_stock_delta
+        GROUP BY id_pdt
+    ) AS delta
+    ON DUPLICATE KEY UPDATE
+        total_prod = stock_courant.total_prod + delta.total_prod,
+        total_cmds = stock_courant.total_cmds + delta.total_cmds;
+    """,
+    # journal : jours nouveaux, soldes repris du dernier jour connu avant eux
+    """
+    INSERT INTO stock_journal (id_pdt, jour, prod_jour, cmds_jour, total_prod, total_cmds)
+    SELECT d.id_pdt, d.jour, 0, 0,
+        COALESCE((SELECT j.total_prod FROM stock_journal AS j
+                  WHERE j.id_pdt = d.id_pdt AND j.jour < d.jour ORDER BY j.jour DESC LIMIT 1), 0),
+        COALESCE((SELECT j.total_cmds FROM stock_journal AS j
+                  WHERE j.id_pdt = d.id_pdt AND j.jour < d.jour ORDER BY j.jour DESC LIMIT 1), 0)
+    FROM stg_stock_delta AS d
+    LEFT JOIN stock_journal AS x ON x.id_pdt = d.id_pdt AND x.jour = d.jour
+    WHERE x.id_pdt IS NULL;
+    """,
+    # journal : mouvements du jour
+    """
+    UPDATE stock_journal AS j
+    JOIN stg_stock_delta AS d ON d.id_pdt = j.id_pdt AND d.jour = j.jour
+    SET j.prod_jour = j.prod_jour + d.prod,
+        j.cmds_jour = j.cmds_jour + d.cmds;
+    """,
+    # journal : soldes des jours >= au delta (antidatage : jours suivants décalés aussi)
+    """
+    UPDATE stock_journal AS j
+    JOIN (
+        SELECT j2.id_pdt, j2.jour, SUM(d.prod) AS prod, SUM(d.cmds) AS cmds
+        FROM stock_journal AS j2
+        JOIN stg_stock_delta AS d ON d.id_pdt = j2.id_pdt AND d.jour <= j2.jour
+        GROUP BY j2.id_pdt, j2.jour
+    ) AS acc ON acc.id_pdt = j.id_pdt AND acc.jour = j.jour
+    SET j.total_prod = j.total_prod + acc.prod,
+        j.total_cmds = j.total_cmds + acc.cmds;
+    """,
+]
+
+# recalcul complet depuis l'historique (initialisation d'une base existante, ou contrôle)
+SQL_REBUILD = {
+    "stock_courant": [
+        "DELETE FROM stock_courant;",
+        """
+        INSERT INTO stock_courant (id_pdt, total_prod, total_cmds)
+        SELECT p.id, COALESCE(prod.total_prod, 0), COALESCE(cmd.total_cmds, 0)
+        FROM produits AS p
+        LEFT JOIN (SELECT id_pdt, SUM(quantite) AS total_prod FROM production GROUP BY id_pdt) AS prod ON prod.id_pdt = p.id
+        LEFT JOIN (SELECT id_pdt, SUM(quantite) AS total_cmds FROM lignes_cmd GROUP BY id_pdt) AS cmd ON cmd.id_pdt = p.id
+        WHERE prod.id_pdt IS NOT NULL OR cmd.id_pdt IS NOT NULL;
+        """,
+    ],
+    "stock_journal": [
+        "DELETE FROM stock_journal;",
+        """
+        INSERT INTO stock_journal (id_pdt, jour, prod_jour, cmds_jour, total_prod, total_cmds)
+        SELECT id_pdt, jour, prod_jour, cmds_jour,
+            SUM(prod_jour) OVER w, SUM(cmds_jour) OVER w
+        FROM (
+            SELECT id_pdt, jour, SUM(prod) AS prod_jour, SUM(cmds) AS cmds_jour
+            FROM (
+                SELECT id_pdt, date AS jour, quantite AS prod, 0 AS cmds FROM production
+                UNION ALL
+                SELECT lc.id_pdt, c.date, 0, lc.quantite
+                FROM lignes_cmd AS lc JOIN commandes AS c ON c.id = lc.id_cmd
+            ) AS mouvements
+            GROUP BY id_pdt, jour
+        ) AS d
+        WINDOW w AS (PARTITION BY id_pdt ORDER BY jour);
+        """,
+    ],
+    "ventes_jour": ["DELETE FROM ventes_jour;", (SQL_SALES_DELTAS[0], (0,))],
+    "commandes_jour": ["DELETE FROM commandes_jour;", (SQL_SALES_DELTAS[1], (0,))],
+}
+
+#---------------
+# FONCTIONS
+#---------------
+
+def add_order_deltas(cursor, max_id_before):
+    """Appelé par load, sans commit, après l'insertion des lignes de commandes."""
+    reset_deltas(cursor)
+    cursor.execute(SQL_DELTAS_CMDS, (max_id_before,))
+    apply_deltas(cursor)
+    for query in SQL_SALES_DELTAS:
+        cursor.execute(query, (max_id_before,))
+
+def add_production_deltas(cursor):
+    """Appelé par load, sans commit, avant l'insertion de la production depuis le staging."""
+    reset_deltas(cursor)
+    cursor.execute(SQL_DELTAS_PROD)
+    apply_deltas(cursor)
+
+def reset_deltas(cursor):
+    cursor.execute(SQL_DELTAS_TABLE)
+    cursor.execute("DELETE FROM stg_stock_delta")  # TRUNCATE validerait la transaction
+
+def apply_deltas(cursor):
+    for query in SQL_APPLY_DELTAS:
+        cursor.execute(query)
+
+def rebuild_aggregates(cursor, tables=None):
+    for table in tables or SQL_REBUILD:
+        for query in SQL_REBUILD[table]:
+            # requête seule, ou (requête, paramètres)
+            if isinstance(query, tuple):
+                cursor.execute(*query)
+            else:
+                cursor.execute(query)
+        log_etl("agregats", table, "Recalcul complet", DATA_LOG)
+    # résultats du tableau de bord en cache périmés
+    bump_generation(cursor)
+
+def ensure_aggregates(cursor):
+    """Base existante sans agrégats (tables ajoutées depuis) : calcul initial depuis l'historique."""
+    cursor.execute("SELECT EXISTS(SELECT 1 FROM production) OR EXISTS(SELECT 1 FROM lignes_cmd)")
+    (has_data,) = cursor.fetchone()
+    if not has_data:
+        return
+    for table in SQL_REBUILD:
+        cursor.execute(f"SELECT EXISTS(SELECT 1 FROM {table})")
+        (filled,) = cursor.fetchone()
+        if not filled:
+            print(f"[INFO] Initialisation de {table} depuis l'historique.")
+            rebuild_aggregates(cursor, [table])
+
+
+if __name__ == "__main__":
+    # python3 scripts/aggregats.py rebuild [table ...]
+    if sys.argv[1:2] != ["rebuild"] or not set(sys.argv[2:]) <= set(SQL_REBUILD):
+        print(f"Usage : python3 scripts/aggregats.py rebuild [{' | '.join(SQL_REBUILD)}]")
+        sys.exit(1)
+    conn = mysql.connector.connect(**MYSQL_CONF)
+    try:
+        cursor = conn.cursor()
+        rebuild_aggregates(cursor, sys.argv[2:])
+        conn.commit()
+        cursor.close()
+        print("[INFO] Agrégats recalculés.")
+    finally:
+        conn.close()
@@ -0,0 +1,180 @@
+import sys
+import sqlite3
+import pandas as pd
+
+from pathlib import Path
+from commun import log_etl
+from commun import DATA_LOG
+from commun import SQLITE_DB_PATH
+from commun import db_connection
+from extract import CDC_TABLES
+from extract import TABLE_ID_COLUMNS
+from extract import get_watermarks
+
+#---------------
+# CONFIGURATION
+#---------------
+
+# Journal des changements de la base SQLite source, alimenté par triggers :
+# une ligne par insert / update / delete sur les tables référentielles.
+CHANGELOG_TABLE = "cdc_changelog"
+CDC_WATERMARK = "cdc_changelog"
+CDC_PAGE_SIZE = 10000
+
+SQL_CHANGELOG = f"""
+CREATE TABLE IF NOT EXISTS {CHANGELOG_TABLE} (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    table_src TEXT NOT NULL,
+    op TEXT NOT NULL CHECK (op IN ('I', 'U', 'D')),
+    pk INTEGER NOT NULL,
+    ts TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+SQL_TRIGGERS = """
+CREATE TRIGGER IF NOT EXISTS cdc_{table}_ins AFTER INSERT ON {table}
+BEGIN
+    INSERT INTO {log} (table_src, op, pk) VALUES ('{table}', 'I', NEW.{pk});
+END;
+CREATE TRIGGER IF NOT EXISTS cdc_{table}_upd AFTER UPDATE ON {table}
+BEGIN
+    INSERT INTO {log} (table_src, op, pk)
+        SELECT '{table}', 'D', OLD.{pk} WHERE OLD.{pk} <> NEW.{pk};
+    INSERT INTO {log} (table_src, op, pk) VALUES ('{table}', 'U', NEW.{pk});
+END;
+CREATE TRIGGER IF NOT EXISTS cdc_{table}_del AFTER DELETE ON {table}
+BEGIN
+    INSERT INTO {log} (table_src, op, pk) VALUES ('{table}', 'D', OLD.{pk});
+END;
+"""
+
+#---------------
+# FONCTIONS
+#---------------
+
+def install_cdc(db_path=SQLITE_DB_PATH, seed=True):
+    """
+    Installe le journal et les triggers dans la base SQLite source.
+    seed=True : les lignes existantes sont journalisées comme insertions,
+    pour que la première synchronisation charge tout le référentiel.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        with conn:
+            conn.executescript(SQL_CHANGELOG)
+            empty = conn.execute(f"SELECT COUNT(*) FROM {CHANGELOG_TABLE}").fetchone()[0] == 0
+            for table in CDC_TABLES:
+                conn.executescript(SQL_TRIGGERS.format(table=table, pk=TABLE_ID_COLUMNS[table], log=CHANGELOG_TABLE))
+                if seed and empty:
+                    conn.execute(
+                        f"INSERT INTO {CHANGELOG_TABLE} (table_src, op, pk) "
+                        f"SELECT '{table}', 'I', {TABLE_ID_COLUMNS[table]} FROM {table} ORDER BY {TABLE_ID_COLUMNS[table]}"
+                    )
+        print(f"[INFO] CDC installé sur {db_path} ({', '.join(CDC_TABLES)}).")
+    finally:
+        conn.close()
+    if empty:
+        # journal neuf : sa séquence repart de 1
+        reset_watermark()
+
+def uninstall_cdc(db_path=SQLITE_DB_PATH):
+    conn = sqlite3.connect(db_path)
+    try:
+        with conn:
+            for table in CDC_TABLES:
+                for suffix in ("ins", "upd", "del"):
+                    conn.execute(f"DROP TRIGGER IF EXISTS cdc_{table}_{suffix}")
+            conn.execute(f"DROP TABLE IF EXISTS {CHANGELOG_TABLE}")
+        print(f"[INFO] CDC retiré de {db_path}.")
+    finally:
+        conn.close()
+    reset_watermark()
+
+def reset_watermark(data_log=DATA_LOG):
+    """
+    Oublie le dernier numéro de séquence appliqué : un journal recréé repart de 1
+    (AUTOINCREMENT remis à zéro avec la table), ses changements ne doivent pas être sautés.
+    """
+    try:
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM etl_watermarks WHERE table_src = %s", (CDC_WATERMARK,))
+            conn.commit()
+            cursor.close()
+    except Exception as e:
+        # base cible indisponible : read_changes détectera la séquence revenue en arrière
+        log_etl("cdc", CDC_WATERMARK, f"Filigrane non reinitialise : {e}", data_log)
+
+def read_changes(db_path=SQLITE_DB_PATH, data_log=DATA_LOG):
+    """
+    Lit le journal au-delà du dernier numéro de séquence appliqué.
+    Les opérations sont réduites à la dernière par (table, clé) ; les lignes
+    à insérer / mettre à jour sont relues dans leur état courant.
+    Retourne ({table: (df_upserts, pks_supprimees)}, dernier seq) ou ({}, None).
+    Journal recréé (séquence sous le filigrane) : relecture depuis le début, et le seq
+    retourné (0 si le journal est vide) écrase le filigrane, même s'il est plus bas.
+    """
+    try:
+        conn = sqlite3.connect(f"{Path(db_path).resolve().as_uri()}?mode=ro", uri=True)
+    except Exception as e:
+        log_etl("sqlite_connexion", db_path, f"Erreur connexion: {e}", data_log)
+        return {}, None
+
+    last_seq = get_watermarks(data_log).get(CDC_WATERMARK, 0)
+    try:
+        conn.execute("BEGIN")  # journal et tables lus dans le même instantané
+        row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (CHANGELOG_TABLE,)).fetchone()
+        if last_seq > (row[0] if row else 0):
+            # journal recréé depuis le dernier filigrane : relecture depuis le début
+            log_etl("cdc", CHANGELOG_TABLE, f"Sequence revenue sous le filigrane {last_seq}, relecture complete", data_log)
+            last_seq = 0
+            max_seq = 0
+        else:
+            max_seq = None
+        last_ops = {}
+        while True:
+            rows = conn.execute(
+                f"SELECT seq, table_src, op, pk FROM {CHANGELOG_TABLE} WHERE seq > ? ORDER BY seq LIMIT ?",
+                (last_seq, CDC_PAGE_SIZE)
+            ).fetchall()
+            if not rows:
+                break
+            for seq, table, op, pk in rows:
+                last_ops[(table, pk)] = op
+            last_seq = max_seq = rows[-1][0]
+
+        changes = {}
+        for table in CDC_TABLES:
+            id_col = TABLE_ID_COLUMNS[table]
+            upserts = [pk for (t, pk), op in last_ops.items() if t == table and op != "D"]
+            deletes = [pk for (t, pk), op in last_ops.items() if t == table and op == "D"]
+            frames = []
+            for start in range(0, len(upserts), CDC_PAGE_SIZE):
+                batch = upserts[start:start + CDC_PAGE_SIZE]
+                placeholders = ", ".join(["?"] * len(batch))
+                frames.append(pd.read_sql_query(
+                    f"SELECT * FROM {table} WHERE {id_col} IN ({placeholders})", conn, params=batch))
+            df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+            # clé journalisée mais absente de l'instantané : supprimée depuis
+            found = set(df[id_col]) if not df.empty else set()
+            deletes += sorted(set(upserts) - found)
+            if not df.empty or deletes:
+                changes[table] = (df, deletes)
+                log_etl("cdc", table, f"{len(df)} insertion(s)/maj, {len(deletes)} suppression(s)", data_log)
+        return changes, max_seq
+    except sqlite3.OperationalError as e:
+        log_etl("cdc", CHANGELOG_TABLE, f"Journal CDC illisible (installe ?) : {e}", data_log)
+        return {}, None
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+if __name__ == "__main__":
+    action = sys.argv[1] if len(sys.argv) > 1 else ""
+    if action == "install":
+        install_cdc()
+    elif action == "uninstall":
+        uninstall_cdc()
+    else:
+        print("Usage : python3 scripts/cdc.py install | uninstall")
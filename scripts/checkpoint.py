@@ -0,0 +1,125 @@
+import os
+import json
+import shutil
+import pandas as pd
+
+from datetime import datetime
+from commun import log_etl
+from commun import DATA_LOG
+
+#---------------
+# CONFIGURATION
+#---------------
+
+# Points de reprise d'un run : la sortie de chaque étape est écrite en Parquet
+# sous checkpoints/<run_id>/<étape>/<table>.parquet, l'avancement dans state.json.
+CHECKPOINT_DIR = DATA_LOG/"checkpoints"
+STATE_FILE = "state.json"
+
+# étapes dans l'ordre ; "load" marque le run terminé
+STAGE_EXTRACT   = "extract"
+STAGE_TRANSFORM = "transform"
+STAGE_LOAD      = "load"
+
+STATUT_EN_COURS = "en_cours"
+STATUT_TERMINE  = "termine"
+
+#---------------
+# FONCTIONS
+#---------------
+
+def new_run_id():
+    return datetime.now().strftime("%Y%m%d_%H%M%S")
+
+def run_dir(run_id):
+    return CHECKPOINT_DIR/run_id
+
+def read_state(run_id):
+    """État du run (étapes terminées, statut), ou None si le run est inconnu."""
+    path = run_dir(run_id)/STATE_FILE
+    if not path.exists():
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def write_state(run_id, state):
+    """Écriture atomique : un arrêt brutal ne laisse jamais un state.json partiel."""
+    state["maj"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    path = run_dir(run_id)/STATE_FILE
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, path)
+
+def save_stage(run_id, stage, dict_df):
+    """
+    Écrit chaque DataFrame de l'étape en Parquet puis l'ajoute à state.json.
+    L'étape n'est marquée terminée qu'une fois tous ses fichiers écrits.
+    """
+    stage_dir = run_dir(run_id)/stage
+    shutil.rmtree(stage_dir, ignore_errors=True)
+    stage_dir.mkdir(parents=True)
+    for table, df in dict_df.items():
+        if df is not None and not df.empty:
+            to_parquet_columns(df).to_parquet(stage_dir/f"{table}.parquet", index=False)
+    state = read_state(run_id) or {"run_id": run_id, "stages": [], "statut": STATUT_EN_COURS}
+    if stage not in state["stages"]:
+        state["stages"].append(stage)
+    write_state(run_id, state)
+    log_etl("checkpoint", stage, f"Run {run_id} : {len(dict_df)} table(s) ecrite(s)", DATA_LOG)
+
+def save_files(run_id, files):
+    """Fichiers CSV du run (fichier, empreinte, lignes), confirmés au manifeste après chargement."""
+    state = read_state(run_id) or {"run_id": run_id, "stages": [], "statut": STATUT_EN_COURS}
+    state["fichiers"] = [[file, list(fingerprint), nb_rows] for file, fingerprint, nb_rows in files]
+    write_state(run_id, state)
+
+def run_files(run_id):
+    state = read_state(run_id) or {}
+    return [(file, tuple(fingerprint), nb_rows) for file, fingerprint, nb_rows in state.get("fichiers", [])]
+
+def load_stage(run_id, stage):
+    """Relit les DataFrames d'une étape terminée : {table: DataFrame}."""
+    stage_dir = run_dir(run_id)/stage
+    return {path.stem: from_parquet_columns(pd.read_parquet(path)) for path in sorted(stage_dir.glob("*.parquet"))}
+
+def to_parquet_columns(df):
+    """
+    Colonnes objet écrites en texte : Arrow refuse les types mêlés
+    (ex. quantité "deux" parmi des entiers, laissée telle quelle pour transform).
+    """
+    object_cols = df.select_dtypes(include="object").columns
+    return df.astype({col: "string" for col in object_cols})
+
+def from_parquet_columns(df):
+    """Colonnes texte rendues en objet (NaN pour les valeurs manquantes), comme à l'extraction."""
+    for col in df.select_dtypes(include="string").columns:
+        df[col] = df[col].astype(object).where(df[col].notna(), float("nan"))
+    return df
+
+def last_stage(run_id):
+    state = read_state(run_id)
+    if state is None or not state["stages"]:
+        return None
+    return state["stages"][-1]
+
+def finish_run(run_id):
+    """Run chargé : les Parquet intermédiaires sont supprimés, state.json reste pour l'audit."""
+    state = read_state(run_id) or {"run_id": run_id, "stages": []}
+    for stage in state["stages"]:
+        shutil.rmtree(run_dir(run_id)/stage, ignore_errors=True)
+    if STAGE_LOAD not in state["stages"]:
+        state["stages"].append(STAGE_LOAD)
+    state["statut"] = STATUT_TERMINE
+    run_dir(run_id).mkdir(parents=True, exist_ok=True)
+    write_state(run_id, state)
+
+def last_unfinished_run():
+    """Run le plus récent resté en cours (pour --resume sans identifiant), sinon None."""
+    if not CHECKPOINT_DIR.exists():
+        return None
+    for path in sorted(CHECKPOINT_DIR.iterdir(), reverse=True):
+        state = read_state(path.name)
+        if state is not None and state.get("statut") == STATUT_EN_COURS:
+            return path.name
+    return None
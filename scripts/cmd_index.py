@@ -0,0 +1,167 @@
+import os
+import json
+import math
+import hashlib
+
+from commun import log_etl
+from commun import DATA_LOG
+from commun import CMD_INDEX_CAPACITY
+from commun import db_connection
+from metrics import stage
+
+#---------------
+# CONFIGURATION
+#---------------
+
+# Index local des num_cmd déjà chargés : filtre de Bloom persistant + filigrane
+# (max commandes.id couvert). Un test négatif est certain ; un test positif est
+# confirmé en base sur les seules clés candidates.
+INDEX_BITS_FILE = os.path.join(DATA_LOG, "index_num_cmd.bloom")
+INDEX_META_FILE = os.path.join(DATA_LOG, "index_num_cmd.json")
+INDEX_FP_RATE = 0.01
+CONFIRM_BATCH = 1000
+
+index_state = None
+
+#---------------
+# FONCTIONS
+#---------------
+
+def find_existing_num_cmd(values):
+    """
+    Retourne l'ensemble des num_cmd de 'values' déjà présents dans commandes.
+    Coût proportionnel au lot entrant, pas à l'historique.
+    """
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            keys = {str(v) for v in values}
+            with stage("lookup.num_cmd", "commandes", rows_in=len(keys)) as m:
+                sync_index(cursor)
+                candidates = [k for k in keys if might_contain(k)]
+                existing = set()
+                for start in range(0, len(candidates), CONFIRM_BATCH):
+                    batch = candidates[start:start + CONFIRM_BATCH]
+                    placeholders = ", ".join(["%s"] * len(batch))
+                    cursor.execute(f"SELECT num_cmd FROM commandes WHERE num_cmd IN ({placeholders})", batch)
+                    existing.update(row[0] for row in cursor.fetchall())
+                m["rows_out"] = len(existing)
+            if candidates:
+                log_etl("index_num_cmd", "commandes", f"{len(keys)} cle(s) testee(s), {len(candidates)} candidate(s), {len(existing)} confirmee(s)", DATA_LOG)
+            return existing
+        finally:
+            cursor.close()
+
+def update_num_cmd_index(conn):
+    """Appelé par load après commit : ajoute à l'index les commandes au-delà du filigrane."""
+    cursor = conn.cursor()
+    try:
+        sync_index(cursor)
+    finally:
+        cursor.close()
+
+def sync_index(cursor):
+    """
+    Recale l'index sur la base par lectures de clé primaire uniquement (coût indépendant
+    de l'historique) : ajout incrémental, ou reconstruction si la base a reculé ou été recréée.
+    Une commande purgée reste dans le filtre : simple faux positif, écarté par la confirmation en base.
+    """
+    state = get_index()
+    cursor.execute("SELECT COALESCE(MAX(id), 0) FROM commandes")
+    (db_max_id,) = cursor.fetchone()
+    meta = state["meta"]
+
+    if db_max_id < meta["watermark"] or not anchor_matches(cursor, meta):
+        # base recréée ou purgée : l'index n'est plus fiable
+        log_etl("index_num_cmd", "commandes", "Filigrane incoherent avec la base, reconstruction", DATA_LOG)
+        state = new_index(max(meta["capacity"], CMD_INDEX_CAPACITY))
+        meta = state["meta"]
+    elif db_max_id == meta["watermark"]:
+        return
+
+    # majorant des clés après ajout (id auto-incrémentés) : au-delà de la capacité,
+    # le taux de faux positifs serait trop élevé, on double
+    expected = meta["count"] + db_max_id - meta["watermark"]
+    if expected > meta["capacity"]:
+        state = new_index(2 * max(expected, meta["capacity"]))
+        meta = state["meta"]
+
+    cursor.execute("SELECT id, num_cmd FROM commandes WHERE id > %s ORDER BY id", (meta["watermark"],))
+    while True:
+        rows = cursor.fetchmany(CONFIRM_BATCH)
+        if not rows:
+            break
+        for id_cmd, num_cmd in rows:
+            add_key(num_cmd)
+            meta["watermark"] = id_cmd
+            meta["ancre"] = num_cmd
+        meta["count"] += len(rows)
+    save_index()
+
+def anchor_matches(cursor, meta):
+    """La commande du filigrane est-elle toujours celle indexée ? (une lecture par clé primaire)"""
+    if meta["watermark"] == 0:
+        return True
+    cursor.execute("SELECT num_cmd FROM commandes WHERE id = %s", (meta["watermark"],))
+    row = cursor.fetchone()
+    return row is not None and row[0] == meta.get("ancre")
+
+def get_index():
+    global index_state
+    if index_state is None:
+        index_state = read_index()
+    return index_state
+
+def read_index():
+    if not (os.path.exists(INDEX_META_FILE) and os.path.exists(INDEX_BITS_FILE)):
+        return new_index(CMD_INDEX_CAPACITY)
+    try:
+        with open(INDEX_META_FILE) as f:
+            meta = json.load(f)
+        with open(INDEX_BITS_FILE, "rb") as f:
+            bits = bytearray(f.read())
+        if len(bits) * 8 < meta["nb_bits"]:
+            raise ValueError("fichier de bits tronque")
+        return {"meta": meta, "bits": bits}
+    except Exception as e:
+        log_etl("index_num_cmd", INDEX_META_FILE, f"Index illisible, reconstruction : {e}", DATA_LOG)
+        return new_index(CMD_INDEX_CAPACITY)
+
+def new_index(capacity):
+    global index_state
+    nb_bits = max(8, int(-capacity * math.log(INDEX_FP_RATE) / (math.log(2) ** 2)))
+    nb_hashes = max(1, round(nb_bits / capacity * math.log(2)))
+    index_state = {
+        "meta": {"capacity": capacity, "nb_bits": nb_bits, "nb_hashes": nb_hashes, "watermark": 0, "ancre": None, "count": 0},
+        "bits": bytearray((nb_bits + 7) // 8),
+    }
+    return index_state
+
+def save_index():
+    """Écriture atomique (fichier temporaire + replace) des bits puis des métadonnées."""
+    state = get_index()
+    os.makedirs(DATA_LOG, exist_ok=True)
+    tmp_bits = INDEX_BITS_FILE + ".tmp"
+    with open(tmp_bits, "wb") as f:
+        f.write(state["bits"])
+    os.replace(tmp_bits, INDEX_BITS_FILE)
+    tmp_meta = INDEX_META_FILE + ".tmp"
+    with open(tmp_meta, "w") as f:
+        json.dump(state["meta"], f)
+    os.replace(tmp_meta, INDEX_META_FILE)
+
+def bit_positions(key, meta):
+    digest = hashlib.blake2b(str(key).encode("utf-8"), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], "little")
+    h2 = int.from_bytes(digest[8:], "little") | 1
+    return [(h1 + i * h2) % meta["nb_bits"] for i in range(meta["nb_hashes"])]
+
+def add_key(key):
+    state = get_index()
+    for pos in bit_positions(key, state["meta"]):
+        state["bits"][pos >> 3] |= 1 << (pos & 7)
+
+def might_contain(key):
+    state = get_index()
+    bits = state["bits"]
+    return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in bit_positions(key, state["meta"]))
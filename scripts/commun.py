@@ -1,9 +1,15 @@
 import os
+import time
+import queue
+import atexit
+import threading
 import mysql.connector
 import pandas as pd
 from pathlib import Path
 
+from contextlib import contextmanager
 from mysql.connector import Error
+from mysql.connector import pooling
 from dotenv import load_dotenv
 from datetime import datetime
 
@@ -31,6 +37,53 @@ DB_NAME = os.getenv("DB_NAME")
 DB_USER = os.getenv("DB_USER")
 DB_PSWD = os.getenv("DB_PSWD")
 
+# extraction SQLite : nombre de lignes par page (parcours par clé primaire)
+SQLITE_PAGE_SIZE = int(os.getenv("SQLITE_PAGE_SIZE", 10000))
+# référentiels SQLite : "id" (nouvelles lignes par filigrane) ou "cdc" (journal des changements)
+SQLITE_SYNC_MODE = os.getenv("SQLITE_SYNC_MODE", "id").lower()
+
+# extraction CSV en flux : nombre de lignes par paquet (0 = fichier lu en entier)
+CSV_CHUNKSIZE = int(os.getenv("CSV_CHUNKSIZE", 0))
+
+# extraction CSV : nombre de fichiers lus en parallèle
+CSV_READ_WORKERS = int(os.getenv("CSV_READ_WORKERS", min(8, os.cpu_count() or 1)))
+
+# chargement : nombre de lignes par paquet d'INSERT
+LOAD_CHUNK_SIZE = int(os.getenv("LOAD_CHUNK_SIZE", 1000))
+# chargement : "insert" (INSERT par paquets) ou "infile" (LOAD DATA LOCAL INFILE)
+LOAD_MODE = os.getenv("LOAD_MODE", "insert").lower()
+
+# mode démon : micro-lot déclenché à N fichiers ou après X secondes d'attente
+DAEMON_BATCH_FILES   = int(os.getenv("DAEMON_BATCH_FILES", 10))
+DAEMON_MAX_LATENCY   = float(os.getenv("DAEMON_MAX_LATENCY", 5))
+DAEMON_POLL_INTERVAL = float(os.getenv("DAEMON_POLL_INTERVAL", 1))
+
+# index local des num_cmd chargés : nombre de clés prévu (taille du filtre de Bloom)
+CMD_INDEX_CAPACITY = int(os.getenv("CMD_INDEX_CAPACITY", 1000000))
+
+# vues : "empreinte" (DDL seulement si la définition a changé, vérifié après chaque ETL),
+# "migration" (vérifié une fois au démarrage, jamais en post-ETL), "toujours" (DDL à chaque run)
+VIEWS_REFRESH = os.getenv("VIEWS_REFRESH", "empreinte").lower()
+
+# partitionnement mensuel des commandes (partitions.py) : mois pré-créés à l'avance
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", 3))
+
+# profilage des étapes (cProfile + tracemalloc + piles échantillonnées), comme --profile
+ETL_PROFILE = os.getenv("ETL_PROFILE", "0").lower() in ("1", "true", "oui", "yes")
+
+# métriques : dossier du textfile collector Prometheus (vide = DATA_LOG/metrics)
+METRICS_TEXTFILE_DIR = os.getenv("METRICS_TEXTFILE_DIR", "")
+# métriques : nombre de rapports JSON conservés dans DATA_LOG/metrics (0 = tous)
+METRICS_KEEP = int(os.getenv("METRICS_KEEP", 200))
+
+# pool de connexions MySQL (lectures : menu, Flask, post-ETL, recherches de clés de transform)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+# attente maximale (secondes) d'une connexion libre quand le pool est épuisé
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))
+
+# cache des résultats du tableau de bord (menu, Flask) : plafond mémoire en Mo (0 = désactivé)
+RESULT_CACHE_MAX_MB = float(os.getenv("RESULT_CACHE_MAX_MB", 64))
+
 MYSQL_CONF = {
     'host':     os.getenv('DB_HOST'),
     'user':     os.getenv('DB_USER'),
@@ -59,26 +112,136 @@ SCHEMA_COLUMNS = {
     "commandes": {"num_cmd", "date", "id_revendeur","id_pdt", "quantite", "prix_unitaire"}
 }
 
+# types imposés à la lecture des CSV commandes (colonnes cibles)
+CSV_DTYPES = {
+    "num_cmd":       str,
+    "date":          str,
+    "id_revendeur":  "Int64",
+    "id_pdt":        "Int64",
+    "quantite":      "Int64",
+    "prix_unitaire": "float64",
+}
+
+# journal : évènements mis en file puis écrits par lots par un thread d'arrière-plan
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", 1.0))
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", 500))
+
+log_queue  = queue.Queue()
+log_lock   = threading.RLock()
+log_wakeup = threading.Event()
+log_thread = None
+
+# pool créé au premier emprunt (la base cible peut ne pas encore exister à l'import)
+db_pool = None
+pool_lock = threading.Lock()
+
 #---------------
 # FONCTIONS
 #---------------
 
 def log_etl(type_evenement, source, message, data_log=DATA_LOG):
-    now       = datetime.now()
-    ts        = now.strftime("%Y-%m-%d %H:%M:%S")
-    date_str  = now.strftime("%Y-%m-%d")
-    log_file  = os.path.join(data_log, f"log_etl_{date_str}.csv")
-
-    os.makedirs(data_log, exist_ok=True)
-    header = not os.path.exists(log_file)
-
-    row = pd.DataFrame([{
-        "timestamp":      ts,
-        "type_evenement": type_evenement,
-        "source":         source,
-        "message":        message
-    }])
-    row.to_csv(log_file, mode="a", index=False, header=header,sep=';')
+    """Ajoute un évènement à la file du journal (écrit par lots en arrière-plan)."""
+    ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    enqueue_logs([(ts, str(data_log), type_evenement, source, message)])
+
+def log_etl_many(events, data_log=DATA_LOG):
+    """
+    Journalise plusieurs évènements d'un coup.
+    events : DataFrame avec les colonnes type_evenement, source, message.
+    """
+    if events.empty:
+        return
+    ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    enqueue_logs([
+        (ts, str(data_log), type_evenement, source, message)
+        for type_evenement, source, message
+        in zip(events["type_evenement"], events["source"], events["message"])
+    ])
+
+def enqueue_logs(records):
+    log_queue.put(records)
+    start_log_writer()
+    if log_queue.qsize() >= LOG_BATCH_SIZE:
+        log_wakeup.set()
+
+def start_log_writer():
+    """Démarre (une fois par processus) le thread qui vide la file du journal."""
+    global log_thread
+    if log_thread is not None and log_thread.is_alive():
+        return
+    with log_lock:
+        if log_thread is None or not log_thread.is_alive():
+            log_thread = threading.Thread(target=log_writer, name="log_etl", daemon=True)
+            log_thread.start()
+
+def log_writer():
+    while True:
+        log_wakeup.wait(LOG_FLUSH_INTERVAL)
+        log_wakeup.clear()
+        try:
+            flush_logs()
+        except Exception as e:
+            print(f"[ERREUR] Ecriture du journal ETL : {e}")
+
+def flush_logs():
+    """
+    Écrit tous les évènements en attente, groupés par fichier journal du jour.
+    Appelé par le thread d'écriture, à la sortie du processus et sur erreur fatale.
+    """
+    with log_lock:
+        records = []
+        while True:
+            try:
+                records.extend(log_queue.get_nowait())
+            except queue.Empty:
+                break
+        if not records:
+            return
+        df = pd.DataFrame(records, columns=["timestamp", "data_log", "type_evenement", "source", "message"])
+        df["date_str"] = df["timestamp"].str[:10]
+        for (data_log, date_str), rows in df.groupby(["data_log", "date_str"], sort=False):
+            log_file = os.path.join(data_log, f"log_etl_{date_str}.csv")
+            os.makedirs(data_log, exist_ok=True)
+            header = not os.path.exists(log_file)
+            rows[["timestamp", "type_evenement", "source", "message"]].to_csv(
+                log_file, mode="a", index=False, header=header, sep=';')
+
+def get_pool():
+    global db_pool
+    if db_pool is None:
+        with pool_lock:
+            if db_pool is None:
+                db_pool = pooling.MySQLConnectionPool(
+                    pool_name="distributech", pool_size=DB_POOL_SIZE, pool_reset_session=True, **MYSQL_CONF)
+    return db_pool
+
+@contextmanager
+def db_connection():
+    """
+    Emprunte une connexion au pool, rendue à la sortie du bloc :
+        with db_connection() as conn:
+            cur = conn.cursor()
+    Contrôle de santé à l'emprunt : une connexion coupée (ping en échec) est rouverte par le pool.
+    Au retour, la session est réinitialisée (transaction en cours, tables temporaires).
+    """
+    pool = get_pool()
+    deadline = time.monotonic() + DB_POOL_TIMEOUT
+    while True:
+        try:
+            conn = pool.get_connection()
+            break
+        except pooling.PoolError:
+            # pool épuisé : on attend qu'une connexion soit rendue
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(0.05)
+    try:
+        yield conn
+    finally:
+        try:
+            conn.close()
+        except Error:
+            pass  # connexion rompue : rendue quand même, rouverte au prochain emprunt
 
 def database_exists():
     try:
@@ -116,4 +279,7 @@ def rename_columns(df,table):
             used_mapping[old_col]=new_col
             changes.append(f"{old_col} -> {new_col},")
     log_etl("colonnes_renommees",table,' '.join(changes),DATA_LOG)
-    return df
\ No newline at end of file
+    return df
+
+# vidage garanti du journal à la sortie du processus
+atexit.register(flush_logs)
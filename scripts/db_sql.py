@@ -7,6 +7,152 @@ from commun import DB_NAME
 from commun import DB_USER
 from commun import DB_PSWD
 from commun import MYSQL_CONF
+from commun import DATA_LOG
+from aggregats import ensure_aggregates
+
+import os
+
+#---------------
+# CONFIGURATION
+#---------------
+
+TABLES_SQL = [
+    # Table régions
+    """
+    CREATE TABLE IF NOT EXISTS regions (
+        id INT NOT NULL PRIMARY KEY,
+        nom VARCHAR(50) NOT NULL
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """,
+    # Table revendeurs
+    """
+    CREATE TABLE IF NOT EXISTS revendeurs (
+        id INT NOT NULL PRIMARY KEY,
+        nom VARCHAR(50) NOT NULL,
+        id_region INT NOT NULL,
+        FOREIGN KEY (id_region) REFERENCES regions(id)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """,
+    # Table produits
+    """
+    CREATE TABLE IF NOT EXISTS produits (
+        id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+        id_src INT NOT NULL,
+        nom VARCHAR(50) NOT NULL,
+        cout_unitaire FLOAT NOT NULL
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """,
+    # Table production
+    """
+    CREATE TABLE IF NOT EXISTS production (
+        id INT NOT NULL PRIMARY KEY,
+        id_pdt INT NOT NULL,
+        quantite INT NOT NULL,
+        date date NOT NULL,
+        FOREIGN KEY (id_pdt) REFERENCES produits(id)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """,
+     # Table commandes
+    """
+    CREATE TABLE IF NOT EXISTS commandes (
+        id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+        num_cmd VARCHAR(30) NOT NULL,
+        date date NOT NULL,
+        id_revendeur INT NOT NULL,
+        FOREIGN KEY (id_revendeur) REFERENCES revendeurs(id)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """,
+    # Table lignes_cmd
+    """
+    CREATE TABLE IF NOT EXISTS lignes_cmd (
+        id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+        id_cmd INT NOT NULL,
+        id_pdt INT NOT NULL,
+        quantite INT NOT NULL,
+        prix_unitaire FLOAT NOT NULL,
+        FOREIGN KEY (id_cmd) REFERENCES commandes(id),
+        FOREIGN KEY (id_pdt) REFERENCES produits(id)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """,
+    # Filigranes d'extraction SQLite (max id chargé par table source),
+    # mis à jour dans la même transaction que les données chargées
+    """
+    CREATE TABLE IF NOT EXISTS etl_watermarks (
+        table_src VARCHAR(50) NOT NULL PRIMARY KEY,
+        last_id BIGINT NOT NULL,
+        maj TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """,
+    # Génération des données du tableau de bord (une ligne), incrémentée dans la
+    # transaction de tout changement de résultats : invalide le cache (result_cache.py)
+    """
+    CREATE TABLE IF NOT EXISTS etl_generation (
+        id TINYINT NOT NULL PRIMARY KEY,
+        generation BIGINT NOT NULL,
+        maj TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """,
+    # Stock courant par produit (cumuls production / commandes),
+    # mis à jour par load avec les lignes insérées dans la même transaction
+    """
+    CREATE TABLE IF NOT EXISTS stock_courant (
+        id_pdt INT NOT NULL PRIMARY KEY,
+        total_prod BIGINT NOT NULL DEFAULT 0,
+        total_cmds BIGINT NOT NULL DEFAULT 0,
+        maj TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        FOREIGN KEY (id_pdt) REFERENCES produits(id) ON DELETE CASCADE
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """,
+    # Journal de stock quotidien par produit : mouvements du jour et soldes cumulés
+    # à la fin du jour (une ligne par jour avec mouvement), alimenté par load
+    """
+    CREATE TABLE IF NOT EXISTS stock_journal (
+        id_pdt INT NOT NULL,
+        jour date NOT NULL,
+        prod_jour BIGINT NOT NULL DEFAULT 0,
+        cmds_jour BIGINT NOT NULL DEFAULT 0,
+        total_prod BIGINT NOT NULL DEFAULT 0,
+        total_cmds BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (id_pdt, jour),
+        FOREIGN KEY (id_pdt) REFERENCES produits(id) ON DELETE CASCADE
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """,
+    # Empreinte (sha256) de la définition de chaque vue créée : DDL rejoué seulement si elle change
+    """
+    CREATE TABLE IF NOT EXISTS etl_vues (
+        nom VARCHAR(64) NOT NULL PRIMARY KEY,
+        empreinte CHAR(64) NOT NULL,
+        maj TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """,
+    # Cube des ventes par jour, revendeur et produit (la région se lit via revendeurs),
+    # alimenté par load : quantités, chiffre d'affaires, commandes contenant le produit
+    """
+    CREATE TABLE IF NOT EXISTS ventes_jour (
+        jour date NOT NULL,
+        id_revendeur INT NOT NULL,
+        id_pdt INT NOT NULL,
+        quantite BIGINT NOT NULL DEFAULT 0,
+        chiffre_affaires DOUBLE NOT NULL DEFAULT 0,
+        nb_commandes INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (jour, id_revendeur, id_pdt)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """,
+    # Nombre de commandes par jour et revendeur : additif, contrairement à
+    # ventes_jour.nb_commandes (une commande compte pour chacun de ses produits)
+    """
+    CREATE TABLE IF NOT EXISTS commandes_jour (
+        jour date NOT NULL,
+        id_revendeur INT NOT NULL,
+        nb_commandes INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (jour, id_revendeur)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """,
+]
+
+#---------------
+# FONCTIONS
+#---------------
 
 def init_database():
     try:
@@ -50,67 +196,8 @@ def init_database():
         user_cursor = user_cnx.cursor()
 
         # 3. Création des tables et insertion des données
-        statements = [
-            # Table régions
-            """
-            CREATE TABLE IF NOT EXISTS regions (
-                id INT NOT NULL PRIMARY KEY,
-                nom VARCHAR(50) NOT NULL
-            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
-            """,
-            # Table revendeurs
-            """
-            CREATE TABLE IF NOT EXISTS revendeurs (
-                id INT NOT NULL PRIMARY KEY,
-                nom VARCHAR(50) NOT NULL,
-                id_region INT NOT NULL,
-                FOREIGN KEY (id_region) REFERENCES regions(id)
-            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
-            """,
-            # Table produits
-            """
-            CREATE TABLE IF NOT EXISTS produits (
-                id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
-                id_src INT NOT NULL,
-                nom VARCHAR(50) NOT NULL,
-                cout_unitaire FLOAT NOT NULL
-            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
-            """,
-            # Table production
-            """
-            CREATE TABLE IF NOT EXISTS production (
-                id INT NOT NULL PRIMARY KEY,
-                id_pdt INT NOT NULL,
-                quantite INT NOT NULL,
-                date date NOT NULL,
-                FOREIGN KEY (id_pdt) REFERENCES produits(id)
-            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
-            """,
-             # Table commandes
-            """
-            CREATE TABLE IF NOT EXISTS commandes (
-                id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
-                num_cmd VARCHAR(30) NOT NULL,
-                date date NOT NULL,
-                id_revendeur INT NOT NULL,
-                FOREIGN KEY (id_revendeur) REFERENCES revendeurs(id)
-            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
-            """,
-            # Table lignes_cmd
-            """
-            CREATE TABLE IF NOT EXISTS lignes_cmd (
-                id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
-                id_cmd INT NOT NULL,
-                id_pdt INT NOT NULL,
-                quantite INT NOT NULL,
-                prix_unitaire FLOAT NOT NULL,
-                FOREIGN KEY (id_cmd) REFERENCES commandes(id),
-                FOREIGN KEY (id_pdt) REFERENCES produits(id)
-            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
-            """,
-        ]
         print("- Création des tables :")
-        for stmt in statements:
+        for stmt in TABLES_SQL:
             user_cursor.execute(stmt)
             print("→ OK :", stmt.strip().split()[5])  # affiche un mot-clé indicatif
         
@@ -123,5 +210,66 @@ def init_database():
         print(f"[Erreur user] {err}")
 
 
+def ensure_schema():
+    """
+    Base existante : crée les tables manquantes (ajoutées depuis sa création)
+    et reprend les anciens filigranes last_<table>_id.txt.
+    """
+    cnx = mysql.connector.connect(**MYSQL_CONF)
+    try:
+        cursor = cnx.cursor()
+        for stmt in TABLES_SQL:
+            cursor.execute(stmt)
+        imported = import_legacy_watermarks(cursor)
+        cnx.commit()
+        cursor.close()
+    finally:
+        cnx.close()
+    # fichiers supprimés une fois les filigranes validés (sinon repris au prochain lancement)
+    for path in imported:
+        os.remove(path)
+
+def init_aggregates():
+    """
+    Agrégats vides d'une base existante calculés depuis l'historique.
+    Appelé après apply_migrations : les requêtes portent sur le schéma à jour.
+    """
+    cnx = mysql.connector.connect(**MYSQL_CONF)
+    try:
+        cursor = cnx.cursor()
+        ensure_aggregates(cursor)
+        cnx.commit()
+        cursor.close()
+    finally:
+        cnx.close()
+
+def import_legacy_watermarks(cursor):
+    """
+    Migration des fichiers last_<table>_id.txt vers etl_watermarks (sans commit).
+    Retourne les chemins des fichiers repris, à supprimer après le commit de l'appelant.
+    """
+    imported = []
+    if not os.path.isdir(DATA_LOG):
+        return imported
+    for fname in os.listdir(DATA_LOG):
+        if not (fname.startswith("last_") and fname.endswith("_id.txt")):
+            continue
+        path = os.path.join(DATA_LOG, fname)
+        table = fname[len("last_"):-len("_id.txt")]
+        try:
+            with open(path) as f:
+                last_id = int(f.read().strip())
+        except (OSError, ValueError):
+            continue
+        cursor.execute(
+            "INSERT INTO etl_watermarks (table_src, last_id) VALUES (%s, %s) AS new "
+            "ON DUPLICATE KEY UPDATE last_id = GREATEST(etl_watermarks.last_id, new.last_id)",
+            (table, last_id)
+        )
+        imported.append(path)
+        print(f"[INFO] Filigrane {table} repris depuis {fname}.")
+    return imported
+
+
 if __name__ == "__main__":
     init_database()
\ No newline at end of file
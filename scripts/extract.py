@@ -1,22 +1,52 @@
 import sqlite3
 import pandas as pd
+import mysql.connector
 import os
 import unidecode
 
+from pathlib import Path
+from importlib.util import find_spec
+
+from functools import lru_cache
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
 from commun import log_etl
 from commun import DATA_IN
 from commun import DATA_LOG
 from commun import DATA_TREATED
 from commun import SQLITE_DB_PATH
+from commun import MYSQL_CONF
+from commun import SQLITE_PAGE_SIZE
+from commun import SQLITE_SYNC_MODE
 from commun import SCHEMA_COLUMNS
+from commun import CSV_DTYPES
+from commun import CSV_READ_WORKERS
+from manifest import file_fingerprint
+from manifest import find_ingested
+from manifest import record_file
+from manifest import save_manifest
+from manifest import STATUT_EN_ATTENTE
+from manifest import STATUT_STRUCTURE
+from manifest import STATUT_ILLISIBLE
+from manifest import STATUT_DOUBLON
+
+# moteur de parsing CSV multi-thread si pyarrow est installé
+CSV_ENGINE = "pyarrow" if find_spec("pyarrow") else "c"
 
 #---------------
 # CONFIGURATION
 #---------------
 
-TABLES_SQLITE  = ["produit", "region", "revendeur", "production"]
+QUARANTINE_DIR = "quarantaine"
+TABLES_SQLITE  = ["region", "revendeur", "produit", "production"]
+CDC_TABLES     = ["region", "revendeur", "produit"]  # synchronisées par cdc.py en mode "cdc"
 TABLE_ID_COLUMNS = {"produit": "product_id","region": "region_id","revendeur": "revendeur_id","production": "production_id"}
 
+# fichiers CSV lus (statut "en_attente" au manifeste), laissés en place jusqu'à ce que leurs
+# lignes soient sauvegardées (point de reprise) ou chargées : (fichier, chemin, empreinte, lignes)
+read_files = []
+
 mapping_csv_to_cible = {
     # numéro de commande
     "numero_commande": "num_cmd","numéro_commande": "num_cmd","num_commande": "num_cmd","numero_de_commande": "num_cmd","numéro de commande": "num_cmd","n°_commande": "num_cmd",
@@ -67,6 +97,17 @@ def extract():
 # BRANCHE 1 : CSV
 #-----------------
 
+def take_read_files():
+    """Retourne et oublie les fichiers lus depuis le dernier appel (à confirmer après chargement)."""
+    files = list(read_files)
+    read_files.clear()
+    return files
+
+def move_read_files(files, dest_dir):
+    for _, path, _, _ in files:
+        if os.path.exists(path):
+            move_file(path, dest_dir)
+
 def move_file(src, dest_dir):
     os.makedirs(dest_dir, exist_ok=True)
     dest = os.path.join(dest_dir, os.path.basename(src))
@@ -81,30 +122,97 @@ def get_csv_files(folder):
 def clean_col(col):
     return unidecode.unidecode(col).replace(" ", "_").lower()
 
+@lru_cache(maxsize=None)
+def map_header(header):
+    """
+    En-tête brut (tuple) -> noms de colonnes cibles (clean_col puis mapping).
+    Mémoïsé : la plupart des fichiers revendeurs partagent le même en-tête.
+    """
+    cleaned = [clean_col(col) for col in header]
+    return tuple(mapping_csv_to_cible.get(col, col) for col in cleaned)
+
+def csv_columns(path):
+    """
+    Colonnes brutes d'un fichier commandes mappées sur le schéma cible (usecols)
+    et leurs types imposés (CSV_DTYPES), communs aux modes lot et flux.
+    """
+    header = tuple(pd.read_csv(path, nrows=0).columns)
+    target = map_header(header)
+    expected_columns = SCHEMA_COLUMNS.get("commandes", set())
+    usecols = [raw for raw, col in zip(header, target) if col in expected_columns]
+    dtypes = {raw: CSV_DTYPES[col] for raw, col in zip(header, target) if col in CSV_DTYPES}
+    return usecols, dtypes
+
+def text_dtypes(dtypes):
+    """Types texte seuls (num_cmd, date) : le reste est inféré, transform rejette les valeurs fautives."""
+    return {raw: dtype for raw, dtype in dtypes.items() if dtype is str}
+
+def read_csv_file(path):
+    """
+    Lecture d'un fichier commandes : seules les colonnes mappées sur le schéma
+    cible sont lues, avec leurs types (CSV_DTYPES) imposés dès le parsing.
+    """
+    usecols, dtypes = csv_columns(path)
+    try:
+        return pd.read_csv(path, engine=CSV_ENGINE, usecols=usecols, dtype=dtypes)
+    except (ValueError, TypeError):
+        # valeur non conforme (ex. quantité "deux") : on ne garde que les types texte,
+        # le reste est inféré et transform rejette les lignes fautives une à une
+        return pd.read_csv(path, engine=CSV_ENGINE, usecols=usecols, dtype=text_dtypes(dtypes))
+
+def normalize_csv_columns(df, file, data_log):
+    """
+    Normalise et mappe les colonnes d'un DataFrame CSV.
+    Retourne None (après log) si des colonnes attendues manquent.
+    """
+    # 1-2. Normalisation + mapping des noms de colonnes (mémoïsé par en-tête)
+    df.columns = list(map_header(tuple(df.columns)))
+
+    # 3. Vérification structure (colonnes attendues)
+    expected_columns = SCHEMA_COLUMNS.get("commandes", set())
+    missing = expected_columns - set(df.columns)
+    if missing:
+        log_etl("structure", file, f"Colonnes manquantes: {sorted(missing)}", data_log)
+        print(f"[ALERTE] {file} -> Colonnes manquantes: {sorted(missing)}")
+        return None
+    return df
+
 def extract_from_csv(data_in, data_treated, data_log):
+    """
+    Lit les CSV de data_in. Les fichiers écartés (doublon, illisible, structure) sont
+    déplacés aussitôt ; les fichiers lus restent en place (voir take_read_files).
+    """
     all_rows = []
 
-    for file in get_csv_files(data_in):
-        path = os.path.join(data_in, file)
+    files = get_csv_files(data_in)
+    paths = [os.path.join(data_in, file) for file in files]
+    with ThreadPoolExecutor(max_workers=CSV_READ_WORKERS) as pool:
+        # 0. Empreintes de contenu : les fichiers déjà intégrés ne sont pas parsés
+        fingerprints = list(pool.map(file_fingerprint, paths))
+        to_read = []
+        seen = {}
+        for file, path, fingerprint in zip(files, paths, fingerprints):
+            if quarantine_if_duplicate(path, fingerprint, seen.get(fingerprint[0]), data_treated, data_log):
+                continue
+            seen[fingerprint[0]] = (file, "dans ce run")
+            to_read.append((file, path, fingerprint))
+
+        # Parsing concurrent des fichiers ; résultats exploités dans l'ordre des fichiers
+        futures = [pool.submit(read_csv_file, path) for _, path, _ in to_read]
+
+    for (file, path, fingerprint), future in zip(to_read, futures):
         try:
-            df = pd.read_csv(path)
+            df = future.result()
         except Exception as e:
             log_etl("lecture_csv", file, str(e), data_log)
+            record_file(file, fingerprint, 0, STATUT_ILLISIBLE)
             move_file(path, data_treated)
             continue
         
-        # 1. Normalisation des noms de colonnes
-        df.columns = [clean_col(col) for col in df.columns]
-
-        # 2. Mapping des colonnes
-        df.rename(columns=mapping_csv_to_cible, inplace=True)
-
-        # 3. Vérification structure (colonnes attendues)
-        expected_columns = SCHEMA_COLUMNS.get("commandes", set())
-        missing = expected_columns - set(df.columns)
-        if missing:
-            log_etl("structure", file, f"Colonnes manquantes: {sorted(missing)}", data_log)
-            print(f"[ALERTE] {file} -> Colonnes manquantes: {sorted(missing)}")
+        # 1-3. Normalisation, mapping et vérification des colonnes
+        df = normalize_csv_columns(df, file, data_log)
+        if df is None:
+            record_file(file, fingerprint, 0, STATUT_STRUCTURE)
             move_file(path, data_treated)
             continue
         
@@ -115,49 +223,191 @@ def extract_from_csv(data_in, data_treated, data_log):
 
         all_rows.append(df)
         log_etl("lecture_ok", file, f"{len(df)} lignes a traiter", data_log)
-        move_file(path, data_treated)
+        record_file(file, fingerprint, len(df), STATUT_EN_ATTENTE)
+        read_files.append((file, path, fingerprint, len(df)))
+    save_manifest()
     if all_rows:
         return pd.concat(all_rows, ignore_index=True)
     else:
         return pd.DataFrame()
 
+def quarantine_if_duplicate(path, fingerprint, seen_in_run, data_treated, data_log):
+    """
+    Fichier au contenu identique à un fichier déjà intégré (ou déjà retenu dans ce run) :
+    il est déplacé en quarantaine sans être parsé. Retourne True dans ce cas.
+    """
+    file = os.path.basename(path)
+    original = seen_in_run or find_ingested(fingerprint[0])
+    if original is None:
+        return False
+    log_etl("fichier_doublon", file, f"Contenu identique a {original[0]} (integre {original[1]}), fichier mis en quarantaine", data_log)
+    print(f"[ALERTE] {file} -> Contenu identique à {original[0]}, fichier mis en quarantaine.")
+    record_file(file, fingerprint, 0, STATUT_DOUBLON)
+    move_file(path, os.path.join(data_treated, QUARANTINE_DIR))
+    return True
+
+def iter_csv_chunks(data_in, data_treated, data_log, chunksize):
+    """
+    Version flux de extract_from_csv : générateur de paquets d'environ chunksize lignes.
+    Les lignes d'une même commande (num_cmd) ne sont jamais coupées entre deux paquets,
+    sinon la 2e partie serait rejetée comme doublon_bdd une fois la 1re chargée : un premier
+    passage compte les lignes de chaque commande (colonne num_cmd seule, tous fichiers),
+    les lignes d'une commande incomplète (non contiguës, ou suite dans un autre fichier)
+    restent en attente. Comme en mode lot, les fichiers lus restent en place (take_read_files).
+    """
+    seen = {}
+    to_read = []
+    expected = Counter()   # commande -> nombre de lignes dans l'ensemble des fichiers
+    for file in get_csv_files(data_in):
+        path = os.path.join(data_in, file)
+        try:
+            fingerprint = file_fingerprint(path)
+        except OSError as e:
+            log_etl("lecture_csv", file, str(e), data_log)
+            continue
+        if quarantine_if_duplicate(path, fingerprint, seen.get(fingerprint[0]), data_treated, data_log):
+            continue
+        seen[fingerprint[0]] = (file, "dans ce run")
+        try:
+            expected.update(order_keys(read_num_cmd(path)))
+        except Exception as e:
+            log_etl("lecture_csv", file, str(e), data_log)
+            record_file(file, fingerprint, 0, STATUT_ILLISIBLE)
+            save_manifest()
+            move_file(path, data_treated)
+            continue
+        to_read.append((file, path, fingerprint))
+
+    counts = Counter()     # commande -> lignes lues
+    buffer = None          # lignes lues, pas encore émises
+    for file, path, fingerprint in to_read:
+        nb_rows = 0
+        statut = STATUT_EN_ATTENTE
+        try:
+            # mêmes colonnes que le mode lot ; num_cmd et date en texte (zéros de tête conservés,
+            # clés identiques au 1er passage). Types numériques inférés : une valeur non conforme
+            # en milieu de fichier ne peut pas être relue sans réémettre les paquets déjà produits
+            usecols, dtypes = csv_columns(path)
+            reader = pd.read_csv(path, chunksize=chunksize, usecols=usecols, dtype=text_dtypes(dtypes))
+            for chunk in reader:
+                chunk = normalize_csv_columns(chunk, file, data_log)
+                if chunk is None:
+                    statut = STATUT_STRUCTURE
+                    break
+                # Colonnes de suivi : l'index des paquets est continu sur le fichier
+                chunk['source_file'] = file
+                chunk['source_idx'] = chunk.index + 1
+                nb_rows += len(chunk)
+                counts.update(order_keys(chunk['num_cmd']))
+
+                buffer = chunk if buffer is None else pd.concat([buffer, chunk])
+                complete = order_keys(buffer['num_cmd']).map(lambda key: counts[key] >= expected[key])
+                if complete.sum() >= chunksize:
+                    yield buffer[complete.values]
+                    buffer = buffer[~complete.values]
+            reader.close()
+        except Exception as e:
+            log_etl("lecture_csv", file, str(e), data_log)
+            statut = STATUT_ILLISIBLE
+
+        if nb_rows:
+            log_etl("lecture_ok", file, f"{nb_rows} lignes a traiter", data_log)
+        record_file(file, fingerprint, nb_rows, statut)
+        save_manifest()
+        if statut == STATUT_EN_ATTENTE:
+            read_files.append((file, path, fingerprint, nb_rows))
+        else:
+            move_file(path, data_treated)
+
+    # reste : commandes complètes, ou dont une partie était dans un fichier écarté
+    if buffer is not None and not buffer.empty:
+        yield buffer
+
+def read_num_cmd(path):
+    """Colonne num_cmd seule d'un fichier (vide si absente : rejet de structure au 2e passage)."""
+    header = tuple(pd.read_csv(path, nrows=0).columns)
+    raw = [col for col, target in zip(header, map_header(header)) if target == "num_cmd"]
+    if not raw:
+        return pd.Series(dtype=object)
+    return pd.read_csv(path, usecols=raw[:1], dtype=str)[raw[0]]
+
+def order_keys(num_cmd):
+    """Clé de regroupement d'une commande, insensible à la casse comme transform."""
+    return num_cmd.astype(str).str.strip().str.lower()
+
 #--------------------
 # BRANCHE 2 : SQLite
 #--------------------
 
-def get_last_id(table, data_log):
-    path = os.path.join(data_log, f"last_{table}_id.txt")
-    if not os.path.exists(path):
-        return 0
+def get_watermarks(data_log):
+    """
+    Filigranes d'extraction (max id déjà chargé par table source), lus en une requête
+    dans la base cible. Base ou table absente : {} (extraction complète).
+    """
+    try:
+        conn = mysql.connector.connect(**MYSQL_CONF)
+    except Exception as e:
+        log_etl("watermark", "etl_watermarks", f"Base cible indisponible, extraction complete : {e}", data_log)
+        return {}
     try:
-        return int(open(path).read().strip())
-    except:
-        return 0
+        cursor = conn.cursor()
+        cursor.execute("SELECT table_src, last_id FROM etl_watermarks")
+        return {table: int(last_id) for table, last_id in cursor.fetchall()}
+    except Exception as e:
+        log_etl("watermark", "etl_watermarks", f"Lecture impossible, extraction complete : {e}", data_log)
+        return {}
+    finally:
+        conn.close()
     
 def extract_from_sqlite(db_path, data_log):
-    sql_rows = {}
+    """Extraction complète du lot SQLite (pages regroupées par table)."""
+    pages = {}
+    for table, df in iter_sqlite_pages(db_path, data_log):
+        pages.setdefault(table, []).append(df)
+    return {table: pd.concat(dfs, ignore_index=True) for table, dfs in pages.items()}
 
+def iter_sqlite_pages(db_path, data_log, page_size=SQLITE_PAGE_SIZE):
+    """
+    Générateur de pages (table, DataFrame) des nouvelles lignes SQLite.
+    La base est ouverte en lecture seule (mode=ro) et lue dans une seule transaction :
+    les quatre tables forment un instantané cohérent. Chaque table est parcourue
+    par clé primaire (id > dernier id lu) en pages d'au plus page_size lignes,
+    dans l'ordre des dépendances (région avant revendeur, produit avant production).
+    En mode SQLITE_SYNC_MODE="cdc", les référentiels sont laissés au journal (cdc.py).
+    """
     if not os.path.exists(db_path):
         log_etl("sqlite_connexion", db_path, "Base SQLite introuvable", data_log)
-        return sql_rows
+        return
     
     try:
-        conn = sqlite3.connect(db_path)
+        conn = sqlite3.connect(f"{Path(db_path).resolve().as_uri()}?mode=ro", uri=True)
     except Exception as e:
         log_etl("sqlite_connexion", db_path, f"Erreur connexion: {e}", data_log)
-        return sql_rows
+        return
 
-    for table in TABLES_SQLITE:
-        last_id = get_last_id(table, data_log)
-        id_col = TABLE_ID_COLUMNS.get(table, "id")
-        try:
-            query = f"SELECT * FROM {table} WHERE {id_col}> {last_id}"
-            df = pd.read_sql_query(query, conn)
-            if not df.empty:
-                sql_rows[table] = df
-            log_etl("sqlite_ok", table, f"{len(df)} lignes a traiter", data_log)
-        except Exception as e:
-            log_etl("sqlite_query", table, f"Erreur requete: {e}", data_log)
-
-    conn.close()
-    return sql_rows
\ No newline at end of file
+    watermarks = get_watermarks(data_log)
+    try:
+        conn.execute("BEGIN")  # instantané : verrou de lecture gardé jusqu'à la fin
+        for table in TABLES_SQLITE:
+            if SQLITE_SYNC_MODE == "cdc" and table in CDC_TABLES:
+                continue
+            last_id = watermarks.get(table, 0)
+            id_col = TABLE_ID_COLUMNS.get(table, "id")
+            query = f"SELECT * FROM {table} WHERE {id_col} > ? ORDER BY {id_col} LIMIT ?"
+            nb_rows = 0
+            try:
+                while True:
+                    df = pd.read_sql_query(query, conn, params=(last_id, page_size))
+                    if df.empty:
+                        break
+                    nb_rows += len(df)
+                    last_id = int(df[id_col].iloc[-1])
+                    yield table, df
+                    if len(df) < page_size:
+                        break
+                log_etl("sqlite_ok", table, f"{nb_rows} lignes a traiter", data_log)
+            except Exception as e:
+                log_etl("sqlite_query", table, f"Erreur requete: {e}", data_log)
+    finally:
+        conn.rollback()
+        conn.close()
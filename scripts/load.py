@@ -1,5 +1,7 @@
 import pandas as pd
 import os
+import time
+import tempfile
 import mysql.connector
 
 from dotenv import load_dotenv
@@ -7,126 +9,497 @@ from commun import log_etl
 from commun import MYSQL_CONF
 from commun import EQUIVALENT_TABLES
 from commun import DATA_LOG
+from commun import LOAD_CHUNK_SIZE
+from commun import LOAD_MODE
+from ref_cache import add_ref_keys
+from ref_cache import invalidate_ref_keys
+from cmd_index import update_num_cmd_index
+from aggregats import add_order_deltas
+from aggregats import add_production_deltas
+from metrics import stage
+from metrics import record
+from result_cache import bump_generation
 
-def load(dict_transformed):
+#---------------
+# CONFIGURATION
+#---------------
+
+# codes d'erreur MySQL quand LOAD DATA LOCAL est refusé (serveur ou client)
+INFILE_DISABLED_ERRNOS = {1148, 2068, 3948}
+infile_available = LOAD_MODE == "infile"
+
+# tables de staging (TEMPORARY : visibles uniquement par la connexion de chargement)
+STAGING_TABLES = {
+    "stg_commandes": """
+        CREATE TEMPORARY TABLE stg_commandes (
+            num_cmd VARCHAR(30) NOT NULL,
+            date date NOT NULL,
+            id_revendeur INT NOT NULL,
+            KEY (num_cmd)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """,
+    "stg_lignes_cmd": """
+        CREATE TEMPORARY TABLE stg_lignes_cmd (
+            num_cmd VARCHAR(30) NOT NULL,
+            id_pdt INT NOT NULL,
+            quantite INT NOT NULL,
+            prix_unitaire FLOAT NOT NULL,
+            KEY (num_cmd)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """,
+    "stg_production": """
+        CREATE TEMPORARY TABLE stg_production (
+            id INT NOT NULL PRIMARY KEY,
+            id_pdt INT NOT NULL,
+            quantite INT NOT NULL,
+            date date NOT NULL
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """,
+    # changements CDC des référentiels (dernier état de chaque clé)
+    "stg_regions": """
+        CREATE TEMPORARY TABLE stg_regions (
+            id INT NOT NULL PRIMARY KEY,
+            nom VARCHAR(50) NOT NULL
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """,
+    "stg_revendeurs": """
+        CREATE TEMPORARY TABLE stg_revendeurs (
+            id INT NOT NULL PRIMARY KEY,
+            nom VARCHAR(50) NOT NULL,
+            id_region INT NOT NULL
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """,
+    "stg_produits": """
+        CREATE TEMPORARY TABLE stg_produits (
+            id_src INT NOT NULL PRIMARY KEY,
+            nom VARCHAR(50) NOT NULL,
+            cout_unitaire FLOAT NOT NULL
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """,
+}
+
+# résolution des clés naturelles (num_cmd, id_src) en id techniques côté serveur ;
+# id_src -> un seul produits.id (le plus ancien) : tant que la migration 1 est reportée
+# par des doublons d'id_src, une jointure directe dupliquerait les lignes
+SQL_RESOLVE_COMMANDES = """
+INSERT INTO commandes (num_cmd, date, id_revendeur)
+SELECT s.num_cmd, s.date, s.id_revendeur
+FROM stg_commandes AS s
+LEFT JOIN commandes AS c ON c.num_cmd = s.num_cmd
+WHERE c.id IS NULL;
+"""
+
+SQL_RESOLVE_LIGNES_CMD = """
+INSERT INTO lignes_cmd (id_cmd, id_pdt, quantite, prix_unitaire, date_cmd)
+SELECT c.id, p.id, s.quantite, s.prix_unitaire, c.date
+FROM stg_lignes_cmd AS s
+JOIN commandes AS c ON c.num_cmd = s.num_cmd AND c.id > %s
+JOIN (SELECT id_src, MIN(id) AS id FROM produits GROUP BY id_src) AS p ON p.id_src = s.id_pdt;
+"""
+
+SQL_SAVE_WATERMARK = """
+INSERT INTO etl_watermarks (table_src, last_id) VALUES (%s, %s) AS new
+ON DUPLICATE KEY UPDATE last_id = GREATEST(etl_watermarks.last_id, new.last_id);
+"""
+
+# séquence du journal CDC : écrasée, pas de GREATEST (un journal recréé repart de 1)
+SQL_SAVE_CDC_WATERMARK = """
+INSERT INTO etl_watermarks (table_src, last_id) VALUES (%s, %s) AS new
+ON DUPLICATE KEY UPDATE last_id = new.last_id;
+"""
+
+SQL_RESOLVE_PRODUCTION = """
+INSERT INTO production (id, id_pdt, quantite, date)
+SELECT s.id, p.id, s.quantite, s.date
+FROM stg_production AS s
+JOIN (SELECT id_src, MIN(id) AS id FROM produits GROUP BY id_src) AS p ON p.id_src = s.id_pdt
+LEFT JOIN production AS x ON x.id = s.id
+WHERE x.id IS NULL;
+"""
+
+# CDC : application ensembliste des insertions / mises à jour depuis le staging
+# (dans l'ordre des dépendances ; les suppressions se font dans l'ordre inverse)
+SQL_UPSERT = {
+    "regions": ["""
+        INSERT INTO regions (id, nom)
+        SELECT * FROM (SELECT id, nom FROM stg_regions) AS s
+        ON DUPLICATE KEY UPDATE nom = s.nom;
+    """],
+    "revendeurs": ["""
+        INSERT INTO revendeurs (id, nom, id_region)
+        SELECT * FROM (SELECT id, nom, id_region FROM stg_revendeurs) AS s
+        ON DUPLICATE KEY UPDATE nom = s.nom, id_region = s.id_region;
+    """],
+    # produits : id_src est unique en cible (migration 1), mais la migration est reportée tant que
+    # des doublons anciens subsistent : mise à jour puis anti-jointure, valables dans les deux cas
+    "produits": ["""
+        UPDATE produits AS p
+        JOIN stg_produits AS s ON s.id_src = p.id_src
+        SET p.nom = s.nom, p.cout_unitaire = s.cout_unitaire;
+    ""","""
+        INSERT INTO produits (id_src, nom, cout_unitaire)
+        SELECT s.id_src, s.nom, s.cout_unitaire
+        FROM stg_produits AS s
+        LEFT JOIN produits AS p ON p.id_src = s.id_src
+        WHERE p.id IS NULL;
+    """],
+}
+CDC_KEYS = {"regions": "id", "revendeurs": "id", "produits": "id_src"}
+STAGING_COLUMNS = {
+    "regions": ("id", "nom"),
+    "revendeurs": ("id", "nom", "id_region"),
+    "produits": ("id_src", "nom", "cout_unitaire"),
+}
+CDC_WATERMARK = "cdc_changelog"
+
+def load(dict_transformed, conn=None):
+    """
+    Charge les DataFrames transformés dans la base cible.
+    conn : connexion à réutiliser (mode démon), sinon une connexion est ouverte pour l'appel.
+    """
 
     results = {}
-    mapping_produits = {}
-    mapping_commandes = {}
 
-    conn = mysql.connector.connect(**MYSQL_CONF)
+    own_conn = conn is None
+    if own_conn:
+        conn = open_load_connection()
     cursor = conn.cursor()
+    create_staging_tables(cursor)
 
     # 1. Insérer d'abord les tables "racines" (sans dépendances)
     if 'regions' in dict_transformed:
         df_regions = dict_transformed['regions']
         if not df_regions.empty:
-            results['regions'] = insert_dataframe(conn, cursor, df_regions, 'regions')
-            max_id = df_regions["id"].max()
-            save_last_id('regions', int(max_id))
+            # données + filigrane dans la même transaction
+            results['regions'] = insert_dataframe(conn, cursor, df_regions, 'regions', commit=False)
+            save_watermark(cursor, 'regions', int(df_regions["id"].max()))
+            conn.commit()
+            update_ref_cache('regions', 'id', df_regions['id'], results['regions'])
 
     if 'revendeurs' in dict_transformed:
         df_revendeurs = dict_transformed['revendeurs']
         if not df_revendeurs.empty:
-            results['revendeurs'] = insert_dataframe(conn, cursor, df_revendeurs, 'revendeurs')
-            max_id = df_revendeurs["id"].max()
-            save_last_id('revendeurs', int(max_id))
+            # données + filigrane dans la même transaction
+            results['revendeurs'] = insert_dataframe(conn, cursor, df_revendeurs, 'revendeurs', commit=False)
+            save_watermark(cursor, 'revendeurs', int(df_revendeurs["id"].max()))
+            conn.commit()
+            update_ref_cache('revendeurs', 'id', df_revendeurs['id'], results['revendeurs'])
 
     if 'produits' in dict_transformed:
         df_produits = dict_transformed['produits']
         if not df_produits.empty:
-            results['produits'] = insert_dataframe(conn, cursor, df_produits, 'produits')
-            max_id = df_produits["id_src"].max()
-            save_last_id('produits', int(max_id))
-
-    # 2. Mettre à jour le mapping produits (id_src -> id auto)
-    cursor.execute("SELECT id, id_src FROM produits")
-    for new_id, id_src in cursor.fetchall():
-        mapping_produits[id_src] = new_id
+            # données + filigrane dans la même transaction
+            results['produits'] = insert_dataframe(conn, cursor, df_produits, 'produits', commit=False)
+            save_watermark(cursor, 'produits', int(df_produits["id_src"].max()))
+            conn.commit()
+            update_ref_cache('produits', 'id_src', df_produits['id_src'], results['produits'])
 
-    # 3. Insérer commandes (doit être fait avant lignes_cmd)
+    # 2. Commandes + lignes_cmd : chargement en staging puis résolution
+    #    des id (num_cmd -> commandes.id, id_src -> produits.id) côté serveur
     if 'commandes' in dict_transformed:
         df_commandes = dict_transformed['commandes']
         if not df_commandes.empty:
             commandes_cols = ['num_cmd', 'date', 'id_revendeur']
-            commandes = df_commandes[commandes_cols].drop_duplicates()
-            results['commandes'] = insert_dataframe(conn, cursor, commandes, 'commandes')
+            # un en-tête par num_cmd (transform rejette les en-têtes incohérents)
+            commandes = df_commandes[commandes_cols].drop_duplicates(subset="num_cmd")
+            bulk_load(conn, cursor, commandes, 'stg_commandes')
 
-            # Mettre à jour le mapping commandes (num_cmd -> id auto)
-            cursor.execute("SELECT id, num_cmd FROM commandes")
-            for new_id, num_cmd in cursor.fetchall():
-                mapping_commandes[num_cmd] = new_id
-
-            # 4. lignes_cmd doit utiliser les id produits & commandes
             lignes_cmd_cols = ['num_cmd', 'id_pdt', 'quantite', 'prix_unitaire']
-            lignes_cmd = df_commandes[lignes_cmd_cols].copy()
-            lignes_cmd['id_cmd'] = lignes_cmd['num_cmd'].map(mapping_commandes)
-            lignes_cmd['id_pdt'] = lignes_cmd['id_pdt'].map(mapping_produits)
-            lignes_cmd = lignes_cmd.drop(columns=['num_cmd'])
-            results['lignes_cmd'] = insert_dataframe(conn, cursor, lignes_cmd, 'lignes_cmd')
+            lignes_cmd = df_commandes[lignes_cmd_cols]
+            bulk_load(conn, cursor, lignes_cmd, 'stg_lignes_cmd')
+
+            results['commandes'], results['lignes_cmd'] = resolve_orders(conn, cursor)
+            # index local des num_cmd : ajout des commandes au-delà du filigrane
+            update_num_cmd_index(conn)
+            if results['lignes_cmd'] < len(lignes_cmd):
+                log_etl("ERREUR_INSERT", "lignes_cmd", f"{len(lignes_cmd) - results['lignes_cmd']} ligne(s) non resolue(s) (commande deja presente ou produit inconnu)", data_log=DATA_LOG)
 
-    # 5. production
+    # 3. production : même principe pour id_pdt (id_src -> produits.id)
     if 'production' in dict_transformed:
         df_production = dict_transformed['production']
         if not df_production.empty:
-            # Remplacement id_pdt
-            if 'id_pdt' in df_production.columns:
-                df_production['id_pdt'] = df_production['id_pdt'].map(mapping_produits)
-            results['production'] = insert_dataframe(conn, cursor, df_production, 'production')
-            max_id = df_production["id"].max()
-            save_last_id('production', int(max_id))
-
-    # Commit & fermeture
+            bulk_load(conn, cursor, df_production[['id', 'id_pdt', 'quantite', 'date']], 'stg_production')
+            results['production'] = resolve_production(conn, cursor, int(df_production["id"].max()))
+            update_ref_cache('production', 'id', df_production['id'], results['production'])
+
+    # Commit & fermeture : nouvelle génération, les résultats en cache sont périmés
+    if results:
+        bump_generation(cursor)
     conn.commit()
     cursor.close()
-    conn.close()
+    if own_conn:
+        conn.close()
+    return results
+
+def apply_changes(dict_upserts, dict_deletes, last_seq, conn=None):
+    """
+    Applique les changements CDC des référentiels : insertions / mises à jour
+    ensemblistes depuis le staging, puis suppressions par paquets. Tout est validé
+    dans une seule transaction avec le numéro de séquence du journal.
+    Retourne {table: (nb upserts, nb suppressions)}.
+    """
+    own_conn = conn is None
+    if own_conn:
+        conn = open_load_connection()
+    cursor = conn.cursor()
+    create_staging_tables(cursor)
+    results = {}
+    try:
+        # staging d'abord : LOAD DATA / paquets d'INSERT valident leur propre transaction
+        for table in CDC_KEYS:
+            df = dict_upserts.get(table)
+            if df is not None and not df.empty:
+                bulk_load(conn, cursor, df[list(STAGING_COLUMNS[table])], f"stg_{table}")
+
+        for table in CDC_KEYS:
+            df = dict_upserts.get(table)
+            if df is not None and not df.empty:
+                for query in SQL_UPSERT[table]:
+                    cursor.execute(query)
+                results[table] = (len(df), 0)
+        for table in reversed(list(CDC_KEYS)):
+            keys = dict_deletes.get(table)
+            if keys:
+                nb_deleted = delete_keys(cursor, table, CDC_KEYS[table], keys)
+                results[table] = (results.get(table, (0, 0))[0], nb_deleted)
+
+        cursor.execute(SQL_SAVE_CDC_WATERMARK, (CDC_WATERMARK, last_seq))
+        if results:
+            bump_generation(cursor)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        log_etl("ERREUR_INSERT", "cdc", f"Application des changements annulee : {e}", data_log=DATA_LOG)
+        raise
+    finally:
+        cursor.close()
+        if own_conn:
+            conn.close()
+
+    for table, col in CDC_KEYS.items():
+        df = dict_upserts.get(table)
+        if dict_deletes.get(table):
+            invalidate_ref_keys(table, col)
+        elif df is not None and not df.empty:
+            add_ref_keys(table, col, df[col])
     return results
 
-def insert_dataframe(conn,cursor, df, table):
+def delete_keys(cursor, table, col, keys, chunk_size=LOAD_CHUNK_SIZE):
+    """
+    Supprime les lignes de 'table' dont 'col' est dans 'keys', par paquets.
+    Une ligne encore référencée (commande, production...) est conservée et journalisée.
+    """
+    nb_deleted = 0
+    keys = [to_sql_value(k) for k in keys]
+    for start in range(0, len(keys), chunk_size):
+        chunk = keys[start:start + chunk_size]
+        placeholders = ", ".join(["%s"] * len(chunk))
+        try:
+            cursor.execute("SAVEPOINT paquet")
+            cursor.execute(f"DELETE FROM {table} WHERE {col} IN ({placeholders})", chunk)
+            nb_deleted += cursor.rowcount
+            cursor.execute("RELEASE SAVEPOINT paquet")
+        except mysql.connector.IntegrityError:
+            cursor.execute("ROLLBACK TO SAVEPOINT paquet")
+            for key in chunk:
+                try:
+                    cursor.execute("SAVEPOINT paquet")
+                    cursor.execute(f"DELETE FROM {table} WHERE {col} = %s", (key,))
+                    nb_deleted += cursor.rowcount
+                    cursor.execute("RELEASE SAVEPOINT paquet")
+                except mysql.connector.IntegrityError as e:
+                    cursor.execute("ROLLBACK TO SAVEPOINT paquet")
+                    log_etl("cdc_suppression", table, f"{col}={key} conserve (encore reference) : {e}", data_log=DATA_LOG)
+    return nb_deleted
+
+def open_load_connection():
+    return mysql.connector.connect(**MYSQL_CONF, allow_local_infile=(LOAD_MODE == "infile"))
+
+def update_ref_cache(table, col, keys, rows_ok):
+    """Répercute les insertions dans le cache des clés ; en cas de rejet partiel, relecture."""
+    if rows_ok == len(keys):
+        add_ref_keys(table, col, keys)
+    else:
+        invalidate_ref_keys(table, col)
+
+def create_staging_tables(cursor):
+    """(Re)crée les tables de staging temporaires, propres à la connexion."""
+    for table, ddl in STAGING_TABLES.items():
+        cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS {table}")
+        cursor.execute(ddl)
+
+def resolve_orders(conn, cursor):
+    """
+    Insère les nouvelles commandes puis leurs lignes depuis le staging,
+    dans une seule transaction. Retourne (nb commandes, nb lignes).
+    """
+    try:
+        with stage("load.resolution", "commandes") as m:
+            cursor.execute("SELECT COALESCE(MAX(id), 0) FROM commandes")
+            (max_id_before,) = cursor.fetchone()
+            cursor.execute(SQL_RESOLVE_COMMANDES)
+            nb_commandes = cursor.rowcount
+            # seules les commandes créées ci-dessus (id > max_id_before) reçoivent des lignes
+            cursor.execute(SQL_RESOLVE_LIGNES_CMD, (max_id_before,))
+            nb_lignes = cursor.rowcount
+            # stock courant : deltas des lignes ci-dessus, même transaction
+            add_order_deltas(cursor, max_id_before)
+            conn.commit()
+            m["rows_out"] = nb_lignes
+    except Exception as e:
+        conn.rollback()
+        log_etl("ERREUR_INSERT", "commandes", f"Resolution staging -> commandes/lignes_cmd annulee : {e}", data_log=DATA_LOG)
+        raise
+    return nb_commandes, nb_lignes
+
+def resolve_production(conn, cursor, last_id):
+    """
+    Insère la production depuis le staging (id_src -> produits.id), met à jour
+    le stock courant et avance son filigrane, dans une seule transaction.
+    """
+    try:
+        with stage("load.resolution", "production") as m:
+            # stock courant : deltas calculés avant insertion (lignes absentes de production)
+            add_production_deltas(cursor)
+            cursor.execute(SQL_RESOLVE_PRODUCTION)
+            nb_production = cursor.rowcount
+            save_watermark(cursor, 'production', last_id)
+            conn.commit()
+            m["rows_out"] = nb_production
+    except Exception as e:
+        conn.rollback()
+        log_etl("ERREUR_INSERT", "production", f"Resolution staging -> production annulee : {e}", data_log=DATA_LOG)
+        raise
+    return nb_production
+
+def insert_dataframe(conn, cursor, df, table, chunk_size=LOAD_CHUNK_SIZE, commit=True):
+    """
+    Insertion par paquets : un executemany paramétré et un commit par paquet.
+    Si un paquet échoue, il est annulé puis rejoué ligne à ligne pour
+    n'écarter que les lignes en erreur.
+    commit=False : rien n'est validé, l'appelant commit (ex. avec le filigrane) ;
+    l'isolation des paquets et des lignes passe alors par des SAVEPOINT.
+    """
     if df.empty:
         print(f"[INFO] Aucune donnée à insérer dans {table}")
         return
     columns = list(df.columns)
+    columns_str = ", ".join(columns)
+    placeholders = ", ".join(["%s"] * len(columns))
+    query = f"INSERT INTO {table} ({columns_str}) VALUES ({placeholders})"
+
+    start_time = time.perf_counter()
+    rows = [tuple(to_sql_value(value) for value in row)
+            for row in df.itertuples(index=False, name=None)]
     rows_ok = 0
 
-    for idx in range(len(df)):
-        row = df.iloc[idx]
-        # Construction des valeurs
-        values = []
-        
-        for value in row:
-            if pd.isna(value):
-                values.append("NULL")
-            elif isinstance(value,pd.Timestamp):
-                values.append(f"'{value.strftime('%Y-%m-%d')}'")
-            elif isinstance(value, str):
-                value = value.replace("'", "\\'")
-                values.append(f"'{value}'")
-            else:
-                values.append(str(value))
-
-        # Construction de la requête
-        columns_str = ", ".join(columns)
-        values_str = ", ".join(values)
-        
-        query = f"INSERT INTO {table} ({columns_str}) VALUES ({values_str});"
-        try : 
-            cursor.execute(query)
-            conn.commit()
-            rows_ok+=1
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        try:
+            begin_unit(cursor, commit)
+            cursor.executemany(query, chunk)
+            end_unit(conn, cursor, commit)
+            rows_ok += len(chunk)
         except Exception as e:
-            log_etl("ERREUR_INSERT",{table},f"Erreur ligne {idx}: {e}",data_log=DATA_LOG)
+            cancel_unit(conn, cursor, commit)
+            log_etl("ERREUR_INSERT", table, f"Paquet lignes {start}-{start + len(chunk) - 1} rejoue ligne a ligne : {e}", data_log=DATA_LOG)
+            # Repli ligne à ligne sur le paquet fautif uniquement
+            for offset, row in enumerate(chunk):
+                try:
+                    begin_unit(cursor, commit)
+                    cursor.execute(query, row)
+                    end_unit(conn, cursor, commit)
+                    rows_ok += 1
+                except Exception as e_row:
+                    cancel_unit(conn, cursor, commit)
+                    log_etl("ERREUR_INSERT", table, f"Erreur ligne {start + offset}: {e_row}", data_log=DATA_LOG)
+    record("load.insert", table, time.perf_counter() - start_time, len(rows), rows_ok)
     return rows_ok
 
-def save_last_id(target_table, last_id):
+def begin_unit(cursor, commit):
+    if not commit:
+        cursor.execute("SAVEPOINT paquet")
+
+def end_unit(conn, cursor, commit):
+    if commit:
+        conn.commit()
+    else:
+        cursor.execute("RELEASE SAVEPOINT paquet")
+
+def cancel_unit(conn, cursor, commit):
+    if commit:
+        conn.rollback()
+    else:
+        cursor.execute("ROLLBACK TO SAVEPOINT paquet")
+
+def bulk_load(conn, cursor, df, table):
+    """
+    Chargement des gros volumes : LOAD DATA LOCAL INFILE si LOAD_MODE=infile,
+    sinon (ou si le serveur refuse local_infile) INSERT par paquets.
+    """
+    global infile_available
+    if df.empty or not infile_available:
+        return insert_dataframe(conn, cursor, df, table)
+    try:
+        return load_infile(conn, cursor, df, table)
+    except mysql.connector.Error as e:
+        conn.rollback()
+        if e.errno in INFILE_DISABLED_ERRNOS:
+            infile_available = False
+        log_etl("load_infile", table, f"LOAD DATA LOCAL indisponible, repli sur INSERT : {e}", data_log=DATA_LOG)
+        return insert_dataframe(conn, cursor, df, table)
+
+def load_infile(conn, cursor, df, table):
+    """Sérialise le DataFrame en TSV temporaire puis l'ingère avec LOAD DATA LOCAL INFILE."""
+    start_time = time.perf_counter()
+    columns_str = ", ".join(df.columns)
+    fd, path = tempfile.mkstemp(suffix=".tsv", prefix=f"{table}_")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8", newline="\n") as f:
+            for row in df.itertuples(index=False, name=None):
+                f.write("\t".join(to_tsv_value(value) for value in row) + "\n")
+        cursor.execute(
+            f"LOAD DATA LOCAL INFILE %s INTO TABLE {table} "
+            "CHARACTER SET utf8mb4 "
+            "FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' "
+            "LINES TERMINATED BY '\\n' "
+            f"({columns_str})",
+            (path,)
+        )
+        rows_ok = cursor.rowcount
+        conn.commit()
+        record("load.infile", table, time.perf_counter() - start_time, len(df), rows_ok)
+        return rows_ok
+    finally:
+        os.remove(path)
+
+def to_tsv_value(value):
+    """Valeur au format attendu par LOAD DATA (NULL -> \\N, caractères spéciaux échappés)."""
+    value = to_sql_value(value)
+    if value is None:
+        return "\\N"
+    return (str(value).replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+def to_sql_value(value):
+    """Convertit une valeur pandas/numpy en type Python accepté par le connecteur."""
+    if pd.isna(value):
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.strftime('%Y-%m-%d')
+    if hasattr(value, "item"):
+        # types numpy (int64, float64...) -> int / float natifs
+        return value.item()
+    return value
+
+def save_watermark(cursor, target_table, last_id):
+    """
+    Avance le filigrane d'extraction SQLite de la table (sans commit :
+    il est validé dans la même transaction que les données qu'il couvre).
+    """
+    name_table = target_table
     for src, target in EQUIVALENT_TABLES.items():
         if target == target_table:
-            name_table=src
+            name_table = src
             break
-        else:
-            name_table=target_table
-    path = f"{DATA_LOG}/last_{name_table}_id.txt"
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, "w") as f:
-        f.write(str(last_id))
-    
\ No newline at end of file
+    cursor.execute(SQL_SAVE_WATERMARK, (name_table, last_id))
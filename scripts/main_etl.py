@@ -1,26 +1,134 @@
 from db_sql import init_database
+from db_sql import ensure_schema
+from db_sql import init_aggregates
+from migrations import apply_migrations
+from partitions import maintain_partitions
 from extract import extract
+from extract import extract_from_sqlite
+from extract import iter_sqlite_pages
+from extract import iter_csv_chunks
+from extract import extract_from_csv
+from extract import get_csv_files
+from extract import move_file
+from extract import take_read_files
+from extract import move_read_files
 from transform import transform
+from transform import drop_loaded_keys
 from load import load
+from load import open_load_connection
+from load import apply_changes
+from cdc import read_changes
 from post_etl import run_post_etl
+from post_etl import refresh_views
 from commun import log_etl
+from commun import flush_logs
 from commun import rename_tables
 from commun import rename_columns
 from commun import database_exists
 from commun import DATA_LOG
+from commun import DATA_IN
+from commun import DATA_TREATED
+from commun import SQLITE_DB_PATH
+from commun import SQLITE_SYNC_MODE
+from commun import CSV_CHUNKSIZE
+from commun import DAEMON_BATCH_FILES
+from commun import DAEMON_MAX_LATENCY
+from commun import DAEMON_POLL_INTERVAL
+from commun import VIEWS_REFRESH
+from ref_cache import reset_ref_cache
+from ref_cache import invalidate_ref_keys
+from ref_cache import ref_cache_stats
+from watcher import FolderWatcher
+from manifest import confirm_files
+from metrics import stage
+from metrics import timed_iter
+from metrics import reset_metrics
+from metrics import write_report
+from profiler import profile_stage
+from profiler import profiled_iter
+from profiler import enable_profiling
+from profiler import write_profiles
+from checkpoint import new_run_id
+from checkpoint import save_stage
+from checkpoint import save_files
+from checkpoint import run_files
+from checkpoint import load_stage
+from checkpoint import last_stage
+from checkpoint import read_state
+from checkpoint import finish_run
+from checkpoint import last_unfinished_run
+from checkpoint import STAGE_EXTRACT
+from checkpoint import STAGE_TRANSFORM
+from checkpoint import STATUT_TERMINE
 
 import subprocess
 import os
+import time
+import signal
+import argparse
+
+from datetime import datetime
+
+from collections import Counter
+from itertools import chain
+
+#---------------
+# CONFIGURATION
+#---------------
+
+# sous-dossier de DATA_IN où le démon regroupe les fichiers prêts d'un micro-lot
+DAEMON_BATCH_DIR = "en_cours"
 
 #-------
 # MAIN
 #-------
 
-def main():
-    
+def main(resume=None):
+    # cache des clés de référence : une lecture par (table, colonne) et par run
+    reset_ref_cache()
+    reset_metrics()
+    statut = "erreur"
+    try:
+        run_etl(resume)
+        statut = "ok"
+    except BaseException as e:
+        # erreur fatale : on trace puis on vide le journal avant de sortir
+        log_etl("erreur", "main_etl", f"ETL interrompu : {e!r}", data_log=DATA_LOG)
+        raise
+    finally:
+        write_report(statut)
+        report_profiles()
+        flush_logs()
+
+def run_etl(resume=None):
+
+    if resume and CSV_CHUNKSIZE > 0:
+        # le mode flux n'écrit pas de points de reprise : rien à reprendre
+        print("[ERREUR] --resume indisponible en mode flux (CSV_CHUNKSIZE > 0) : relancer sans --resume.")
+        log_etl("reprise", "main_etl", "Reprise refusee : mode flux (CSV_CHUNKSIZE > 0) sans points de reprise", data_log=DATA_LOG)
+        return
+
     # 0. Vérification base cible existe
+    check_target_db()
+    sync_references()
+
+    if resume:
+        loaded = resume_run(resume)
+    elif CSV_CHUNKSIZE > 0:
+        loaded = run_streaming(CSV_CHUNKSIZE)
+    else:
+        loaded = run_batch()
+    if not loaded:
+        return
+
+    # 5 génération de l'état du stock
+    with profile_stage("post_etl"), stage("post_etl"):
+        run_post_etl()
+
+def check_target_db():
     print("***** Vérification base cible *****")
     if not database_exists():
+        # les filigranes (etl_watermarks) disparaissent avec la base : extraction complète
         for fname in os.listdir(DATA_LOG):
             if fname.startswith("last_") and fname.endswith("_id.txt"):
                 path = os.path.join(DATA_LOG, fname)
@@ -32,59 +140,362 @@ def main():
         init_database()
         
     else:
+        ensure_schema()
         print(f"[INFO] Base déjà existante.\n")
 
+    # index et contraintes : migrations versionnées en attente
+    apply_migrations()
+    # agrégats absents d'une base existante : calcul initial, sur le schéma migré
+    init_aggregates()
+    # partitions mensuelles (si activées) : mois à venir
+    maintain_partitions()
+    # vues traitées comme une migration : vérifiées ici, plus en post-ETL
+    if VIEWS_REFRESH == "migration":
+        refresh_views()
+
+def run_batch():
+    """
+    Mode par défaut : tout le lot (CSV + SQLite) est extrait, transformé puis chargé en une fois.
+    La sortie de l'extraction et de la transformation est conservée en Parquet (reprise avec --resume).
+    """
+    run_id = new_run_id()
+
     # 1. Extraction
-    print("***** 1. Extraction des données *****")
-    dict_data = extract()
+    print(f"***** 1. Extraction des données (run {run_id}) *****")
+    with profile_stage("extract"), stage("extract") as m:
+        dict_data = extract()
+        m["rows_out"] = count_rows(dict_data)
+    files = take_read_files()
     if not dict_data:
+        move_read_files(files, DATA_TREATED)
+        confirm_files(manifest_entries(files))
         print("Aucune donnée trouvée, fin du process.")
-        return
+        return False
     print("Extraction terminée :")
-    for table,df in dict_data.items():
-        print(f"-> {table} : {len(df)} lignes.")
-        log_etl("extract_ok", table, f"{len(df)} lignes", data_log=DATA_LOG)  
+    report_extract({table: len(df) for table, df in dict_data.items()})
+    # CSV déplacés dans DATA_TREATED une fois le lot sauvegardé : il n'existe plus qu'ici
+    save_stage(run_id, STAGE_EXTRACT, dict_data)
+    save_files(run_id, manifest_entries(files))
+    move_read_files(files, DATA_TREATED)
+
+    return process_data(dict_data, run_id=run_id)
+
+def resume_run(run_id):
+    """Reprend un run interrompu après sa dernière étape terminée ("last" : le plus récent)."""
+    if run_id == "last":
+        run_id = last_unfinished_run()
+        if run_id is None:
+            print("[INFO] Aucun run interrompu à reprendre.")
+            return False
+    state = read_state(run_id)
+    if state is None:
+        print(f"[ERREUR] Run {run_id} inconnu.")
+        return False
+    if state["statut"] == STATUT_TERMINE:
+        print(f"[INFO] Run {run_id} déjà terminé.")
+        return False
+
+    done = last_stage(run_id)
+    print(f"***** Reprise du run {run_id} après l'étape '{done}' *****")
+    log_etl("reprise", "main_etl", f"Run {run_id} repris apres {done}", data_log=DATA_LOG)
+    if done == STAGE_TRANSFORM:
+        # extraction et validation sautées : chargement direct
+        dict_transformed = drop_loaded_keys(load_stage(run_id, STAGE_TRANSFORM))
+        return load_data(keep_non_empty(dict_transformed), run_id=run_id)
+    return process_data(load_stage(run_id, STAGE_EXTRACT), run_id=run_id)
+
+def process_data(dict_data, load_conn=None, run_id=None):
+    """
+    Renommage, transformation et chargement d'un lot extrait. Retourne True si des lignes ont été chargées.
+    run_id : sortie de la transformation écrite en point de reprise.
+    """
 
     # 2 Renommage des noms de tables et colonnes
-    dict_data=rename_tables(dict_data)
-    for table,df in dict_data.items():
-        renamed_df=rename_columns(df,table)
-        dict_data[table]=renamed_df
+    with profile_stage("rename"), stage("rename", rows_in=count_rows(dict_data)):
+        dict_data = rename_data(dict_data)
     print(f"-> Renommage noms tables et colonnes(voir log)\n")
     log_etl("rename_ok", "global", "Tables et colonnes renommees", data_log=DATA_LOG)
     
     # 3 Transformation
     print("***** 2. Transformation des données ******")
-    dict_transformed, rejected_indices = transform(dict_data)
+    with profile_stage("transform"), stage("transform", rows_in=count_rows(dict_data)) as m:
+        dict_transformed, rejected_indices = transform(dict_data)
+        m["rows_out"] = count_rows(dict_transformed)
     print("Transformation terminée :")
-    for table,df in dict_transformed.items():
-        if len(df) > 0 :
-            print(f"-> {table} : {len(df)} ligne(s) nettoyée(s).")
-            log_etl("transform_ok", table, f"{len(df)} lignes nettoyees", data_log=DATA_LOG) 
-    for table, indices in rejected_indices.items():
-        if len(indices) > 0:
-            print(f"[ALERTE] {table} : {len(indices)} ligne(s) rejetée(s) (voir log)")
+    report_transform(
+        {table: len(df) for table, df in dict_transformed.items()},
+        {table: len(indices) for table, indices in rejected_indices.items()},
+    )
     # vérification qu'il y a toujours des données
-    non_empty_dict= {
-        table:df for table,df in dict_transformed.items()
-        if df is not None and not df.empty 
-    }
+    non_empty_dict = keep_non_empty(dict_transformed)
+    if run_id is not None:
+        save_stage(run_id, STAGE_TRANSFORM, non_empty_dict)
+    return load_data(non_empty_dict, load_conn, run_id)
+
+def load_data(non_empty_dict, load_conn=None, run_id=None):
     if not non_empty_dict :
         print(f"[INFO] Aucune donnée à charger.")
-        return
+        if run_id is not None:
+            end_run(run_id)
+        return False
    
     # 4 Chargement dans la base cible
     print(f"\n***** 3 : Chargement dans la BDD centrale *****")
-    load_results=load(non_empty_dict)
+    with profile_stage("load"), stage("load", rows_in=count_rows(non_empty_dict)) as m:
+        results = load(non_empty_dict, conn=load_conn)
+        m["rows_out"] = sum(v or 0 for v in results.values())
+    report_load(results)
+    if run_id is not None:
+        end_run(run_id)
+    return True
+
+def end_run(run_id):
+    """Lot chargé : ses fichiers passent au statut intégré, puis le run est marqué terminé."""
+    confirm_files(run_files(run_id))
+    finish_run(run_id)
+
+def run_streaming(chunksize):
+    """
+    Mode flux (CSV_CHUNKSIZE > 0) : les référentiels SQLite sont chargés d'abord,
+    page par page, puis chaque paquet de lignes CSV traverse renommage, transformation et chargement
+    avant la lecture du paquet suivant. La mémoire reste bornée par la taille du paquet.
+    Pas de points de reprise (--resume refusé) : un run interrompu est relancé, les fichiers
+    non intégrés restent dans DATA_IN et les commandes déjà chargées sont rejetées en doublon.
+    """
+    extracted, transformed, rejected, loaded = Counter(), Counter(), Counter(), Counter()
+
+    print(f"***** Mode flux : lecture CSV par paquets de {chunksize} lignes *****")
+    # pages SQLite (instantané lecture seule) puis paquets CSV
+    batches = chain(
+        ({table: df} for table, df in iter_sqlite_pages(SQLITE_DB_PATH, DATA_LOG)),
+        ({"commandes": chunk} for chunk in iter_csv_chunks(DATA_IN, DATA_TREATED, DATA_LOG, chunksize)),
+    )
+    # une seule connexion de chargement pour tous les paquets
+    load_conn = open_load_connection()
+    try:
+        for dict_data in timed_iter("extract", profiled_iter("extract", batches), count_rows):
+            extracted.update({table: len(df) for table, df in dict_data.items()})
+            with profile_stage("rename"), stage("rename", rows_in=count_rows(dict_data)):
+                dict_data = rename_data(dict_data)
+            with profile_stage("transform"), stage("transform", rows_in=count_rows(dict_data)) as m:
+                dict_transformed, rejected_indices = transform(dict_data)
+                m["rows_out"] = count_rows(dict_transformed)
+            transformed.update({table: len(df) for table, df in dict_transformed.items()})
+            rejected.update({table: len(indices) for table, indices in rejected_indices.items()})
+            non_empty_dict = keep_non_empty(dict_transformed)
+            if non_empty_dict:
+                with profile_stage("load"), stage("load", rows_in=count_rows(non_empty_dict)) as m:
+                    results = load(non_empty_dict, conn=load_conn)
+                    m["rows_out"] = sum(v or 0 for v in results.values())
+                loaded.update(results)
+    finally:
+        load_conn.close()
+
+    # toutes les lignes lues sont chargées (ou rejetées) : fichiers déplacés et intégrés
+    files = take_read_files()
+    move_read_files(files, DATA_TREATED)
+    confirm_files(manifest_entries(files))
+    if not extracted:
+        print("Aucune donnée trouvée, fin du process.")
+        return False
+    print("Extraction terminée :")
+    report_extract(extracted)
+    print("\nTransformation terminée :")
+    report_transform(transformed, rejected)
+    if not loaded:
+        print(f"[INFO] Aucune donnée à charger.")
+        return False
+    print(f"\n***** Chargement dans la BDD centrale *****")
+    report_load(loaded)
+    return True
+
+def sync_references(load_conn=None):
+    """
+    Mode SQLITE_SYNC_MODE="cdc" : applique les changements du journal SQLite
+    (insertions, mises à jour, suppressions) aux référentiels avant les commandes.
+    Retourne {table: (nb upserts, nb suppressions)} ({} si rien n'a été appliqué).
+    """
+    if SQLITE_SYNC_MODE != "cdc":
+        return {}
+    print("***** Synchronisation des référentiels (CDC) *****")
+    changes, last_seq = read_changes(SQLITE_DB_PATH, DATA_LOG)
+    if last_seq is None:
+        print("[INFO] Aucun changement dans le journal.\n")
+        return {}
+    dict_data = rename_data({table: df for table, (df, _) in changes.items() if not df.empty})
+    dict_upserts, _ = transform(dict_data, upsert=True)
+    dict_deletes = {}
+    for table, (_, keys) in rename_tables(changes).items():
+        if keys:
+            dict_deletes[table] = keys
+    with profile_stage("cdc"), stage("cdc", rows_in=count_rows(dict_upserts) + sum(len(k) for k in dict_deletes.values())):
+        results = apply_changes(dict_upserts, dict_deletes, last_seq, conn=load_conn)
+    for table, (nb_upserts, nb_deleted) in results.items():
+        print(f"-> {table} : {nb_upserts} insertion(s)/mise(s) à jour, {nb_deleted} suppression(s).")
+        log_etl("cdc_ok", table, f"{nb_upserts} upserts, {nb_deleted} suppressions", data_log=DATA_LOG)
+    print(f"Journal appliqué jusqu'à la séquence {last_seq}.\n")
+    return results
+
+#-------------------
+# ETAPES / RAPPORTS
+#-------------------
+
+def rename_data(dict_data):
+    dict_data = rename_tables(dict_data)
+    for table, df in dict_data.items():
+        dict_data[table] = rename_columns(df, table)
+    return dict_data
+
+def manifest_entries(files):
+    """Fichiers lus (fichier, chemin, empreinte, lignes) -> entrées du manifeste."""
+    return [(file, fingerprint, nb_rows) for file, _, fingerprint, nb_rows in files]
+
+def count_rows(dict_df):
+    return sum(len(df) for df in dict_df.values() if df is not None)
+
+def keep_non_empty(dict_transformed):
+    return {
+        table:df for table,df in dict_transformed.items()
+        if df is not None and not df.empty 
+    }
+
+def report_extract(counts):
+    for table, count in counts.items():
+        print(f"-> {table} : {count} lignes.")
+        log_etl("extract_ok", table, f"{count} lignes", data_log=DATA_LOG)  
+
+def report_transform(counts, rejected_counts):
+    for table, count in counts.items():
+        if count > 0 :
+            print(f"-> {table} : {count} ligne(s) nettoyée(s).")
+            log_etl("transform_ok", table, f"{count} lignes nettoyees", data_log=DATA_LOG) 
+    for table, count in rejected_counts.items():
+        if count > 0:
+            print(f"[ALERTE] {table} : {count} ligne(s) rejetée(s) (voir log)")
+
+def report_load(load_results):
     for table,count in load_results.items():
         print(f"-> {table} : {count} ligne(s) ajoutée(s).")
         log_etl("load_ok", table, f"{count} lignes inserees", data_log=DATA_LOG)
-    print(f"Chargement terminé.\n")
+    print(f"Chargement terminé.")
+    stats = ref_cache_stats()
+    print(f"-> Cache des clés : {stats['hits']} lecture(s) évitée(s), {stats['misses']} lecture(s) en base.\n")
+    log_etl("ref_cache", "global", f"{stats['hits']} hits, {stats['misses']} misses", data_log=DATA_LOG)
 
-    # 5 génération de l'état du stock
-    run_post_etl()
-    
+def report_profiles():
+    out_dir = write_profiles()
+    if out_dir is not None:
+        print(f"[INFO] Profils (pstats, allocations, piles) écrits dans {out_dir}")
+
+def run_daemon():
+    """
+    Mode démon : surveille DATA_IN (inotify, sinon scrutation) et traite les fichiers
+    par micro-lots, déclenchés par nombre de fichiers ou par latence maximale.
+    Base vérifiée et vues créées une seule fois ; connexions et caches restent chauds.
+    """
+    stop = []
+    signal.signal(signal.SIGTERM, lambda *_: stop.append(True))
+
+    check_target_db()
+    if VIEWS_REFRESH != "migration":  # sinon déjà fait par check_target_db
+        refresh_views()
+    reset_ref_cache()
+    load_conn = open_load_connection()
+    watcher = FolderWatcher(DATA_IN, DAEMON_POLL_INTERVAL)
+    batch_dir = os.path.join(DATA_IN, DAEMON_BATCH_DIR)
+    os.makedirs(batch_dir, exist_ok=True)
+    print(f"***** Mode démon ({watcher.mode}) : surveillance de {DATA_IN} *****")
+    log_etl("daemon", "global", f"Demarrage ({watcher.mode})", data_log=DATA_LOG)
+
+    # fichiers arrivés pendant l'arrêt du démon, ou restés d'un micro-lot interrompu
+    arrivals = {name: time.monotonic() for name in watcher.existing_files()}
+    arrivals.update({name: time.monotonic() for name in get_csv_files(batch_dir)})
+    try:
+        while not stop:
+            for name in watcher.wait(DAEMON_POLL_INTERVAL):
+                arrivals.setdefault(name, time.monotonic())
+            # fichiers prêts mis de côté : ils ne seront plus modifiés ni re-signalés
+            for name in arrivals:
+                path = os.path.join(DATA_IN, name)
+                if os.path.exists(path):
+                    move_file(path, batch_dir)
+            if not arrivals:
+                continue
+            oldest = min(arrivals.values())
+            if len(arrivals) >= DAEMON_BATCH_FILES or time.monotonic() - oldest >= DAEMON_MAX_LATENCY:
+                if not load_conn.is_connected():
+                    load_conn.reconnect()
+                ok = run_micro_batch(batch_dir, len(arrivals), load_conn)
+                arrivals.clear()
+                if not ok:
+                    # fichiers du micro-lot en échec restés dans batch_dir : nouvel essai après DAEMON_MAX_LATENCY
+                    arrivals.update({name: time.monotonic() for name in get_csv_files(batch_dir)})
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print("[INFO] Arrêt du démon.")
+        log_etl("daemon", "global", "Arret", data_log=DATA_LOG)
+        watcher.close()
+        load_conn.close()
+        flush_logs()
+
+def run_micro_batch(batch_dir, nb_files, load_conn):
+    """
+    Traite les fichiers de batch_dir. Ils n'en sortent qu'une fois leurs lignes chargées :
+    en cas d'échec ils y restent pour un nouvel essai. Retourne False si le micro-lot a échoué.
+    """
+    print(f"\n***** Micro-lot {datetime.now():%Y-%m-%d %H:%M:%S} : {nb_files} fichier(s) *****")
+    reset_metrics()
+    statut = "erreur"
+    take_read_files()  # fichiers d'un micro-lot précédent en échec : relus ci-dessous
+    try:
+        # cache des clés conservé entre micro-lots : tables synchronisées relues au prochain accès
+        for table in sync_references(load_conn):
+            invalidate_ref_keys(table)
+        dict_data = {}
+        df_csv = extract_from_csv(batch_dir, DATA_TREATED, DATA_LOG)
+        files = take_read_files()
+        if not df_csv.empty:
+            dict_data["commandes"] = df_csv
+        dict_data.update(extract_from_sqlite(SQLITE_DB_PATH, DATA_LOG))
+        if dict_data:
+            report_extract({table: len(df) for table, df in dict_data.items()})
+            loaded = process_data(dict_data, load_conn=load_conn)
+        else:
+            loaded = False
+        move_read_files(files, DATA_TREATED)
+        confirm_files(manifest_entries(files))
+        if loaded:
+            with profile_stage("post_etl"), stage("post_etl"):
+                run_post_etl(refresh=False, interactive=False)
+        statut = "ok"
+        return True
+    except Exception as e:
+        # un micro-lot en échec ne doit pas arrêter le démon ; ses fichiers restent dans batch_dir
+        print(f"[ERREUR] Micro-lot interrompu, fichiers conservés pour un nouvel essai : {e}")
+        log_etl("erreur", "daemon", f"Micro-lot interrompu, fichiers conserves dans {batch_dir} : {e!r}", data_log=DATA_LOG)
+        return False
+    finally:
+        write_report(statut)
+        report_profiles()
+        flush_logs()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="ETL Distributech")
+    parser.add_argument("--daemon", action="store_true",
+                        help="surveille DATA_IN et traite les fichiers par micro-lots")
+    parser.add_argument("--resume", nargs="?", const="last", metavar="RUN_ID",
+                        help="reprend un run interrompu depuis ses points de reprise (défaut : le dernier ; mode lot uniquement)")
+    parser.add_argument("--profile", action="store_true",
+                        help="profile chaque étape (cProfile, tracemalloc, piles) dans DATA_LOG/profil (équivaut à ETL_PROFILE=1)")
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    args = parse_args()
+    if args.profile:
+        enable_profiling()
+    if args.daemon:
+        run_daemon()
+    else:
+        main(args.resume)
\ No newline at end of file
@@ -0,0 +1,91 @@
+import os
+import hashlib
+import pandas as pd
+
+from datetime import datetime
+from commun import DATA_LOG
+
+#---------------
+# CONFIGURATION
+#---------------
+
+# Manifeste des fichiers CSV reçus : empreinte de contenu (sha256) + taille/mtime,
+# nombre de lignes et statut, pour écarter les renvois de fichiers identiques
+# et garder une trace d'audit de chaque fichier.
+MANIFEST_FILE = os.path.join(DATA_LOG, "manifest_csv.csv")
+MANIFEST_COLUMNS = ["sha256", "fichier", "taille", "mtime", "lignes", "statut", "date"]
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# statuts ; un fichier lu est "en_attente" jusqu'au commit de ses lignes, puis "integre"
+STATUT_EN_ATTENTE = "en_attente"
+STATUT_INTEGRE   = "integre"
+STATUT_DOUBLON   = "doublon"
+STATUT_STRUCTURE = "structure"
+STATUT_ILLISIBLE = "illisible"
+
+known_hashes = None   # sha256 -> (fichier, date) des fichiers intégrés
+known_stats  = {}     # (fichier, taille, mtime) -> sha256 : pré-contrôle sans relire le contenu
+pending      = []
+
+#---------------
+# FONCTIONS
+#---------------
+
+def load_manifest():
+    global known_hashes
+    if known_hashes is not None:
+        return
+    known_hashes = {}
+    if not os.path.exists(MANIFEST_FILE):
+        return
+    df = pd.read_csv(MANIFEST_FILE, sep=";", dtype={"sha256": str, "fichier": str, "statut": str, "date": str})
+    for row in df.itertuples(index=False):
+        known_stats[(row.fichier, int(row.taille), int(row.mtime))] = row.sha256
+        if row.statut == STATUT_INTEGRE:
+            known_hashes.setdefault(row.sha256, (row.fichier, row.date))
+
+def file_fingerprint(path):
+    """
+    Retourne (sha256, taille, mtime) du fichier. Si nom, taille et mtime
+    sont déjà connus, l'empreinte enregistrée est reprise sans relire le fichier.
+    """
+    load_manifest()
+    stat = os.stat(path)
+    key = (os.path.basename(path), stat.st_size, stat.st_mtime_ns)
+    if key in known_stats:
+        return known_stats[key], stat.st_size, stat.st_mtime_ns
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            sha.update(block)
+    return sha.hexdigest(), stat.st_size, stat.st_mtime_ns
+
+def find_ingested(sha256):
+    """(fichier, date) du fichier déjà intégré avec ce contenu, sinon None."""
+    load_manifest()
+    return known_hashes.get(sha256)
+
+def record_file(file, fingerprint, nb_rows, statut):
+    """Ajoute une entrée au manifeste (écrite par save_manifest)."""
+    load_manifest()
+    sha256, taille, mtime = fingerprint
+    date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    pending.append((sha256, file, taille, mtime, nb_rows, statut, date))
+    known_stats[(file, taille, mtime)] = sha256
+    if statut == STATUT_INTEGRE:
+        known_hashes.setdefault(sha256, (file, date))
+
+def confirm_files(files):
+    """Lignes chargées : les fichiers (fichier, empreinte, lignes) passent au statut intégré."""
+    for file, fingerprint, nb_rows in files:
+        record_file(file, fingerprint, nb_rows, STATUT_INTEGRE)
+    save_manifest()
+
+def save_manifest():
+    if not pending:
+        return
+    os.makedirs(DATA_LOG, exist_ok=True)
+    header = not os.path.exists(MANIFEST_FILE)
+    pd.DataFrame(pending, columns=MANIFEST_COLUMNS).to_csv(
+        MANIFEST_FILE, mode="a", index=False, header=header, sep=";")
+    pending.clear()
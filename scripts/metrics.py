@@ -0,0 +1,195 @@
+import os
+import sys
+import json
+import time
+import threading
+
+from contextlib import contextmanager
+from datetime import datetime
+from commun import DATA_LOG
+from commun import METRICS_TEXTFILE_DIR
+from commun import METRICS_KEEP
+
+try:
+    import resource  # Unix uniquement
+except ImportError:
+    resource = None
+
+#---------------
+# CONFIGURATION
+#---------------
+
+# Mesures du run : (étape, table) -> appels, durée, lignes en entrée / sortie, pic mémoire.
+# Une étape exécutée plusieurs fois (paquets, micro-lots) est cumulée.
+# Pic mémoire d'une étape : RSS courante (/proc/self/statm) relevée à l'entrée, à la sortie
+# et toutes les RSS_SAMPLE_INTERVAL secondes par un thread tant que l'étape est active.
+METRICS_DIR = DATA_LOG/"metrics"
+PROM_FILE = "distributech_etl.prom"
+PROM_PREFIX = "distributech_etl"
+RSS_SAMPLE_INTERVAL = 0.05
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+stats = {}
+run_info = {"debut": None, "start": None}
+active = []      # enregistrements des étapes en cours (échantillonnés)
+sampler = {"thread": None, "lock": threading.Lock()}
+
+#---------------
+# FONCTIONS
+#---------------
+
+def reset_metrics():
+    stats.clear()
+    run_info["debut"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    run_info["start"] = time.perf_counter()
+
+@contextmanager
+def stage(name, table="", rows_in=None):
+    """
+    Chronomètre un bloc. Le dict retourné permet de renseigner les lignes :
+        with stage("transform.format", table, rows_in=len(df)) as m:
+            ...
+            m["rows_out"] = len(df)
+    """
+    rec = {"rows_in": rows_in, "rows_out": None, "peak": current_rss()}
+    start_sampler()
+    with sampler["lock"]:
+        active.append(rec)
+    start = time.perf_counter()
+    try:
+        yield rec
+    finally:
+        with sampler["lock"]:
+            active[:] = [r for r in active if r is not rec]
+        peak = max(rec["peak"], current_rss())
+        record(name, table, time.perf_counter() - start, rec["rows_in"], rec["rows_out"], peak)
+
+def record(name, table, seconds, rows_in=None, rows_out=None, peak=None):
+    entry = stats.setdefault((name, table), {"appels": 0, "secondes": 0.0, "lignes_entree": 0, "lignes_sortie": 0, "pic_rss_octets": 0})
+    entry["appels"] += 1
+    entry["secondes"] += seconds
+    entry["lignes_entree"] += rows_in or 0
+    entry["lignes_sortie"] += rows_out if rows_out is not None else (rows_in or 0)
+    entry["pic_rss_octets"] = max(entry["pic_rss_octets"], peak if peak is not None else current_rss())
+
+def start_sampler():
+    if sampler["thread"] is not None:
+        return
+    with sampler["lock"]:
+        if sampler["thread"] is None:
+            sampler["thread"] = threading.Thread(target=sample_rss, name="etl-metrics", daemon=True)
+            sampler["thread"].start()
+
+def sample_rss():
+    while True:
+        time.sleep(RSS_SAMPLE_INTERVAL)
+        if not active:
+            continue
+        rss = current_rss()
+        with sampler["lock"]:
+            for rec in active:
+                rec["peak"] = max(rec["peak"], rss)
+
+def current_rss():
+    """Mémoire résidente actuelle (octets) ; hors Linux, pic du processus à défaut."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return peak_rss()
+
+def peak_rss():
+    """Pic de mémoire résidente du processus (octets), 0 si non mesurable."""
+    if resource is None:
+        return 0
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == "darwin" else maxrss * 1024  # Linux : Ko
+
+def build_report(statut):
+    duration = time.perf_counter() - run_info["start"] if run_info["start"] else 0.0
+    stages = []
+    for (name, table), entry in stats.items():
+        rows = entry["lignes_entree"]
+        stages.append(dict(
+            etape=name, table=table, **entry,
+            lignes_par_seconde=round(rows / entry["secondes"], 1) if entry["secondes"] > 0 else None,
+        ))
+    return {
+        "debut": run_info["debut"],
+        "fin": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "statut": statut,
+        "duree_secondes": round(duration, 3),
+        "pic_rss_octets": peak_rss(),
+        "etapes": stages,
+    }
+
+def write_report(statut="ok"):
+    """
+    Écrit le rapport JSON du run (metrics/run_<date>.json) et le fichier
+    Prometheus pour le textfile collector de node_exporter.
+    """
+    report = build_report(statut)
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    name = f"run_{datetime.now():%Y%m%d_%H%M%S_%f}.json"
+    with open(METRICS_DIR/name, "w") as f:
+        json.dump(report, f, indent=2)
+    prune_reports()
+    write_atomic(os.path.join(METRICS_TEXTFILE_DIR or METRICS_DIR, PROM_FILE), to_prometheus(report))
+    return report
+
+def prune_reports(keep=METRICS_KEEP):
+    """Ne garde que les 'keep' rapports JSON les plus récents (un par micro-lot en mode démon)."""
+    if keep <= 0:
+        return
+    reports = sorted(METRICS_DIR.glob("run_*.json"))
+    for path in reports[:-keep]:
+        path.unlink(missing_ok=True)
+
+def to_prometheus(report):
+    lines = []
+    series = [
+        ("stage_seconds", "secondes", "Durée cumulée de l'étape"),
+        ("stage_calls", "appels", "Nombre d'exécutions de l'étape"),
+        ("stage_rows_in", "lignes_entree", "Lignes en entrée de l'étape"),
+        ("stage_rows_out", "lignes_sortie", "Lignes en sortie de l'étape"),
+        ("stage_rows_per_second", "lignes_par_seconde", "Débit de l'étape (lignes en entrée par seconde)"),
+        ("stage_peak_rss_bytes", "pic_rss_octets", "Pic de mémoire résidente pendant l'étape"),
+    ]
+    for metric, key, help_text in series:
+        lines.append(f"# HELP {PROM_PREFIX}_{metric} {help_text}")
+        lines.append(f"# TYPE {PROM_PREFIX}_{metric} gauge")
+        for s in report["etapes"]:
+            if s[key] is not None:
+                lines.append(f'{PROM_PREFIX}_{metric}{{stage="{s["etape"]}",table="{s["table"]}"}} {s[key]}')
+    lines += [
+        f"# TYPE {PROM_PREFIX}_run_seconds gauge",
+        f"{PROM_PREFIX}_run_seconds {report['duree_secondes']}",
+        f"# TYPE {PROM_PREFIX}_run_success gauge",
+        f"{PROM_PREFIX}_run_success {1 if report['statut'] == 'ok' else 0}",
+        f"# TYPE {PROM_PREFIX}_run_peak_rss_bytes gauge",
+        f"{PROM_PREFIX}_run_peak_rss_bytes {report['pic_rss_octets']}",
+        f"# TYPE {PROM_PREFIX}_last_run_timestamp_seconds gauge",
+        f"{PROM_PREFIX}_last_run_timestamp_seconds {int(time.time())}",
+    ]
+    return "\n".join(lines) + "\n"
+
+def write_atomic(path, content):
+    """Le collecteur ne doit jamais lire un fichier à moitié écrit."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        f.write(content)
+    os.replace(tmp, path)
+
+def timed_iter(name, iterable, count=len):
+    """Itère en chronométrant chaque production d'élément (ex. pages / paquets d'un générateur)."""
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        rows = count(item)
+        record(name, "", time.perf_counter() - start, rows, rows)
+        yield item
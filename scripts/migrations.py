@@ -0,0 +1,204 @@
+import os
+import time
+import mysql.connector
+
+from datetime import datetime
+from commun import log_etl
+from commun import MYSQL_CONF
+from commun import DATA_LOG
+from partitions import is_partitioned
+
+#---------------
+# CONFIGURATION
+#---------------
+
+# Migrations versionnées du schéma cible, appliquées au démarrage de main_etl.
+# Chaque version appliquée est enregistrée dans schema_migrations ; une colonne
+# ou un index déjà présent est ignoré (une migration interrompue peut être rejouée).
+SQL_MIGRATIONS_TABLE = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INT NOT NULL PRIMARY KEY,
+    nom VARCHAR(100) NOT NULL,
+    duree_ms INT NOT NULL,
+    applique_le TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+"""
+
+# (version, nom, [(table, index, définition)], contrôles : requêtes qui doivent ne rien retourner,
+#  [(table, colonne, définition)], requêtes idempotentes exécutées après l'ajout des colonnes)
+# Une migration dont un contrôle échoue est reportée sans bloquer les suivantes :
+# aucune colonne requise par load ne doit donc dépendre d'une migration contrôlée.
+# Clé unique sur une table partitionnée (partitions.py) : refusée par MySQL sans la date,
+# elle est retirée de la migration avec son contrôle (num_cmd reste un index simple).
+MIGRATIONS = [
+    (1, "cles naturelles uniques", [
+        ("commandes", "uq_commandes_num_cmd", "UNIQUE KEY uq_commandes_num_cmd (num_cmd)"),
+        ("produits",  "uq_produits_id_src",   "UNIQUE KEY uq_produits_id_src (id_src)"),
+    ], [
+        ("commandes", "SELECT num_cmd FROM commandes GROUP BY num_cmd HAVING COUNT(*) > 1 LIMIT 5"),
+        ("produits",  "SELECT id_src FROM produits GROUP BY id_src HAVING COUNT(*) > 1 LIMIT 5"),
+    ], [], []),
+    (2, "index dates et lignes couvrants", [
+        # périodes et recalculs par date
+        ("commandes",  "idx_commandes_date",  "KEY idx_commandes_date (date, id_revendeur)"),
+        # deltas de load (commandes créées -> lignes) et reconstruction des agrégats
+        ("lignes_cmd", "idx_lignes_cmd_cmd",  "KEY idx_lignes_cmd_cmd (id_cmd, id_pdt, quantite, prix_unitaire)"),
+        ("lignes_cmd", "idx_lignes_cmd_pdt",  "KEY idx_lignes_cmd_pdt (id_pdt, quantite)"),
+        ("production", "idx_production_pdt",  "KEY idx_production_pdt (id_pdt, date, quantite)"),
+    ], [], [], []),
+    # date de la commande recopiée sur ses lignes : clé de partitionnement possible (partitions.py)
+    (3, "date de commande sur lignes_cmd", [], [], [
+        ("lignes_cmd", "date_cmd", "date NULL"),
+    ], [
+        "UPDATE lignes_cmd AS lc JOIN commandes AS c ON c.id = lc.id_cmd SET lc.date_cmd = c.date WHERE lc.date_cmd IS NULL",
+        "ALTER TABLE lignes_cmd MODIFY date_cmd date NOT NULL",
+    ]),
+    # génération du cache des résultats déplacée dans etl_generation (db_sql.py) :
+    # etl_watermarks ne garde que les filigranes d'extraction SQLite
+    (4, "generation hors des filigranes", [], [], [], [
+        "DELETE FROM etl_watermarks WHERE table_src = 'generation_etl'",
+    ]),
+]
+
+# requêtes représentatives expliquées avant / après application
+REPORT_QUERIES = {
+    "v_stock": "SELECT * FROM v_stock",
+    "stock_a_date": """
+        SELECT p.id_src, j.total_prod, j.total_cmds FROM produits AS p
+        LEFT JOIN stock_journal AS j ON j.id_pdt = p.id AND j.jour = (
+            SELECT MAX(j2.jour) FROM stock_journal AS j2 WHERE j2.id_pdt = p.id AND j2.jour <= CURDATE())
+    """,
+    "periode_ventes": """
+        SELECT vj.id_revendeur, SUM(vj.quantite) FROM ventes_jour AS vj
+        WHERE vj.jour >= CURDATE() - INTERVAL 30 DAY GROUP BY vj.id_revendeur
+    """,
+    "doublon_num_cmd": "SELECT num_cmd FROM commandes WHERE num_cmd IN ('cmd-0001', 'cmd-0002')",
+    "resolution_id_src": "SELECT id FROM produits WHERE id_src = 1",
+    "delta_commandes": """
+        SELECT lc.id_pdt, c.date, SUM(lc.quantite) FROM commandes AS c
+        JOIN lignes_cmd AS lc ON lc.id_cmd = c.id WHERE c.id > 0 GROUP BY lc.id_pdt, c.date
+    """,
+    "recalcul_stock": "SELECT id_pdt, SUM(quantite) FROM lignes_cmd GROUP BY id_pdt",
+}
+EXPLAIN_COLUMNS = ["table", "type", "key", "rows", "Extra"]
+
+#---------------
+# FONCTIONS
+#---------------
+
+def apply_migrations():
+    """Applique les migrations en attente ; retourne les versions appliquées."""
+    conn = mysql.connector.connect(**MYSQL_CONF)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(SQL_MIGRATIONS_TABLE)
+        cursor.execute("SELECT version FROM schema_migrations")
+        done = {row[0] for row in cursor.fetchall()}
+        pending = [m for m in MIGRATIONS if m[0] not in done]
+        if not pending:
+            return []
+
+        before = explain_all(cursor)
+        applied = []
+        for version, name, indexes, checks, columns, statements in pending:
+            start = time.perf_counter()
+            indexes, checks = skip_partitioned_unique(cursor, version, indexes, checks)
+            # contrôle en échec : seule cette migration est reportée (rejouée au prochain lancement),
+            # les suivantes (colonnes dont dépend le code) sont appliquées
+            if blocked_by_data(cursor, version, checks):
+                continue
+            for table, column, definition in columns:
+                if not column_exists(cursor, table, column):
+                    cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+            for query in statements:
+                cursor.execute(query)
+            for table, index, definition in indexes:
+                if not index_exists(cursor, table, index):
+                    cursor.execute(f"ALTER TABLE {table} ADD {definition}")
+            duration = int((time.perf_counter() - start) * 1000)
+            cursor.execute("INSERT INTO schema_migrations (version, nom, duree_ms) VALUES (%s, %s, %s)",
+                           (version, name, duration))
+            conn.commit()
+            applied.append(version)
+            print(f"[INFO] Migration {version} appliquée : {name} ({duration} ms)")
+            log_etl("migration", "schema", f"Version {version} appliquee : {name}", DATA_LOG)
+
+        if applied:
+            write_explain_report(before, explain_all(cursor), applied)
+        return applied
+    finally:
+        cursor.close()
+        conn.close()
+
+def blocked_by_data(cursor, version, checks):
+    """True si un contrôle retourne des lignes (doublons empêchant une clé unique)."""
+    for table, query in checks:
+        cursor.execute(query)
+        rows = cursor.fetchall()
+        if rows:
+            message = f"Migration {version} bloquee : doublons dans {table} ({', '.join(str(r[0]) for r in rows)})"
+            log_etl("migration", table, message, DATA_LOG)
+            print(f"[ERREUR] {message}")
+            return True
+    return False
+
+def skip_partitioned_unique(cursor, version, indexes, checks):
+    """Retire les clés uniques (et leurs contrôles) des tables partitionnées."""
+    skipped = {table for table, _, definition in indexes
+               if definition.startswith("UNIQUE") and is_partitioned(cursor, table)}
+    for table in sorted(skipped):
+        log_etl("migration", table, f"Migration {version} : cle unique ignoree (table partitionnee)", DATA_LOG)
+    indexes = [(table, index, definition) for table, index, definition in indexes
+               if not (table in skipped and definition.startswith("UNIQUE"))]
+    checks = [(table, query) for table, query in checks if table not in skipped]
+    return indexes, checks
+
+def index_exists(cursor, table, index):
+    cursor.execute(
+        "SELECT 1 FROM information_schema.statistics "
+        "WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s LIMIT 1",
+        (table, index)
+    )
+    return cursor.fetchone() is not None
+
+def column_exists(cursor, table, column):
+    cursor.execute(
+        "SELECT 1 FROM information_schema.columns "
+        "WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s LIMIT 1",
+        (table, column)
+    )
+    return cursor.fetchone() is not None
+
+def explain_all(cursor):
+    """Plan de chaque requête représentative : {nom: [lignes EXPLAIN]} (erreur : message)."""
+    plans = {}
+    for name, query in REPORT_QUERIES.items():
+        try:
+            cursor.execute(f"EXPLAIN {query}")
+            cols = [d[0] for d in cursor.description]
+            plans[name] = [dict(zip(cols, row)) for row in cursor.fetchall()]
+        except mysql.connector.Error as e:
+            plans[name] = str(e)
+    return plans
+
+def format_plan(plan):
+    if isinstance(plan, str):
+        return [f"    (indisponible : {plan})"]
+    return ["    " + " | ".join(f"{col}={row.get(col)}" for col in EXPLAIN_COLUMNS) for row in plan]
+
+def write_explain_report(before, after, applied):
+    os.makedirs(DATA_LOG, exist_ok=True)
+    path = os.path.join(DATA_LOG, f"explain_migrations_{datetime.now():%Y%m%d_%H%M%S}.txt")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f"Migrations appliquees : {', '.join(map(str, applied))}\n")
+        for name in REPORT_QUERIES:
+            f.write(f"\n== {name} ==\n  avant :\n")
+            f.write("\n".join(format_plan(before.get(name))) + "\n")
+            f.write("  apres :\n")
+            f.write("\n".join(format_plan(after.get(name))) + "\n")
+    print(f"[INFO] Rapport EXPLAIN avant / après : {path}")
+
+
+if __name__ == "__main__":
+    if not apply_migrations():
+        print("[INFO] Schéma à jour.")
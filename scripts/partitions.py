@@ -0,0 +1,190 @@
+import sys
+import mysql.connector
+
+from datetime import date
+from commun import log_etl
+from commun import MYSQL_CONF
+from commun import DATA_LOG
+from commun import PARTITION_MONTHS_AHEAD
+from result_cache import bump_generation
+
+#---------------
+# CONFIGURATION
+#---------------
+
+# Partitionnement mensuel (RANGE COLUMNS sur la date) des tables de commandes, optionnel :
+#  ▪︎ activer   : conversion des tables (à lancer une fois, tables verrouillées pendant la copie)
+#  ▪︎ maintenir : création des partitions des mois à venir (aussi fait au démarrage de main_etl)
+#  ▪︎ archiver  : les mois antérieurs à AAAA-MM sont échangés (EXCHANGE PARTITION) vers des
+#                 tables <table>_arch_AAAAMM puis leurs partitions vides supprimées
+# Contraintes MySQL : pas de clé étrangère sur une table partitionnée, et chaque clé unique
+# doit contenir la date. Les clés étrangères sont retirées (load ne résout que des id existants)
+# et num_cmd redevient un index simple (l'anti-jointure de load garantit l'unicité).
+PARTITIONED_TABLES = {"commandes": "date", "lignes_cmd": "date_cmd"}
+PRIMARY_KEYS = {"commandes": "id, date", "lignes_cmd": "id, date_cmd"}
+LAST_PARTITION = "pmax"
+
+#---------------
+# FONCTIONS
+#---------------
+
+def enable_partitioning(months_ahead=PARTITION_MONTHS_AHEAD):
+    conn = mysql.connector.connect(**MYSQL_CONF)
+    cursor = conn.cursor()
+    try:
+        if all(is_partitioned(cursor, table) for table in PARTITIONED_TABLES):
+            print("[INFO] Tables déjà partitionnées.")
+            return
+        drop_foreign_keys(cursor)
+        if index_exists(cursor, "commandes", "uq_commandes_num_cmd"):
+            cursor.execute("ALTER TABLE commandes DROP INDEX uq_commandes_num_cmd, ADD KEY idx_commandes_num_cmd (num_cmd)")
+        elif not index_exists(cursor, "commandes", "idx_commandes_num_cmd"):
+            # migration 1 reportée (doublons) : elle n'ajoutera plus la clé unique, index simple ici
+            cursor.execute("ALTER TABLE commandes ADD KEY idx_commandes_num_cmd (num_cmd)")
+
+        cursor.execute("SELECT MIN(date) FROM commandes")
+        (first_date,) = cursor.fetchone()
+        first = month_start(first_date or date.today())
+        last = add_months(month_start(date.today()), months_ahead)
+        for table, column in PARTITIONED_TABLES.items():
+            if is_partitioned(cursor, table):
+                continue
+            cursor.execute(f"ALTER TABLE {table} DROP PRIMARY KEY, ADD PRIMARY KEY ({PRIMARY_KEYS[table]})")
+            parts = [partition_sql(month) for month in month_range(first, last)]
+            parts.append(f"PARTITION {LAST_PARTITION} VALUES LESS THAN (MAXVALUE)")
+            cursor.execute(f"ALTER TABLE {table} PARTITION BY RANGE COLUMNS({column}) ({', '.join(parts)})")
+            print(f"[INFO] {table} partitionnée par mois ({first:%Y-%m} -> {last:%Y-%m}).")
+            log_etl("partitions", table, f"Partitionnement mensuel {first:%Y-%m} -> {last:%Y-%m}", DATA_LOG)
+    finally:
+        cursor.close()
+        conn.close()
+
+def maintain_partitions(months_ahead=PARTITION_MONTHS_AHEAD):
+    """Pré-crée les partitions jusqu'au mois courant + months_ahead (sans effet si non partitionné)."""
+    conn = mysql.connector.connect(**MYSQL_CONF)
+    cursor = conn.cursor()
+    try:
+        last = add_months(month_start(date.today()), months_ahead)
+        for table in PARTITIONED_TABLES:
+            months = partition_months(cursor, table)
+            if not months:
+                continue
+            missing = month_range(add_months(max(months), 1), last)
+            if not missing:
+                continue
+            parts = [partition_sql(month) for month in missing]
+            parts.append(f"PARTITION {LAST_PARTITION} VALUES LESS THAN (MAXVALUE)")
+            cursor.execute(f"ALTER TABLE {table} REORGANIZE PARTITION {LAST_PARTITION} INTO ({', '.join(parts)})")
+            log_etl("partitions", table, f"{len(missing)} partition(s) creee(s) jusqu'a {last:%Y-%m}", DATA_LOG)
+    finally:
+        cursor.close()
+        conn.close()
+
+def archive_partitions(before):
+    """
+    Archive les mois antérieurs à 'before' (date, 1er du mois) par échange de partition :
+    aucune copie ni DELETE sur les tables actives. Les agrégats (stocks, cube des ventes)
+    conservent l'historique archivé ; un recalcul complet ne porterait plus que sur les tables actives.
+    """
+    conn = mysql.connector.connect(**MYSQL_CONF)
+    cursor = conn.cursor()
+    archived = 0
+    try:
+        for table in PARTITIONED_TABLES:
+            for month in partition_months(cursor, table):
+                if month >= before:
+                    continue
+                name = f"p{month:%Y%m}"
+                archive = f"{table}_arch_{month:%Y%m}"
+                if table_exists(cursor, archive):
+                    print(f"[ALERTE] {archive} existe déjà, partition {table}.{name} conservée.")
+                    continue
+                cursor.execute(f"CREATE TABLE {archive} LIKE {table}")
+                cursor.execute(f"ALTER TABLE {archive} REMOVE PARTITIONING")
+                cursor.execute(f"ALTER TABLE {table} EXCHANGE PARTITION {name} WITH TABLE {archive}")
+                cursor.execute(f"ALTER TABLE {table} DROP PARTITION {name}")
+                print(f"[INFO] {table}.{name} archivée dans {archive}.")
+                log_etl("partitions", table, f"Partition {name} archivee dans {archive}", DATA_LOG)
+                archived += 1
+        if archived:
+            # commandes sorties des tables actives : résultats du tableau de bord en cache périmés
+            bump_generation(cursor)
+            conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+
+def is_partitioned(cursor, table):
+    cursor.execute(
+        "SELECT COUNT(*) FROM information_schema.partitions "
+        "WHERE table_schema = DATABASE() AND table_name = %s AND partition_name IS NOT NULL",
+        (table,)
+    )
+    return cursor.fetchone()[0] > 0
+
+def partition_months(cursor, table):
+    """Mois (1er du mois) des partitions pAAAAMM de la table, triés ; [] si non partitionnée."""
+    cursor.execute(
+        "SELECT partition_name FROM information_schema.partitions "
+        "WHERE table_schema = DATABASE() AND table_name = %s AND partition_name LIKE 'p______'",
+        (table,)
+    )
+    return sorted(date(int(name[1:5]), int(name[5:7]), 1) for (name,) in cursor.fetchall())
+
+def drop_foreign_keys(cursor):
+    """Retire les clés étrangères portées par ou pointant vers les tables à partitionner."""
+    tables = tuple(PARTITIONED_TABLES)
+    cursor.execute(
+        "SELECT table_name, constraint_name FROM information_schema.referential_constraints "
+        "WHERE constraint_schema = DATABASE() AND (table_name IN (%s, %s) OR referenced_table_name IN (%s, %s))",
+        tables + tables
+    )
+    for table, constraint in cursor.fetchall():
+        cursor.execute(f"ALTER TABLE {table} DROP FOREIGN KEY {constraint}")
+        log_etl("partitions", table, f"Cle etrangere {constraint} retiree", DATA_LOG)
+
+def index_exists(cursor, table, index):
+    cursor.execute(
+        "SELECT 1 FROM information_schema.statistics "
+        "WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s LIMIT 1",
+        (table, index)
+    )
+    return cursor.fetchone() is not None
+
+def table_exists(cursor, table):
+    cursor.execute(
+        "SELECT 1 FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s",
+        (table,)
+    )
+    return cursor.fetchone() is not None
+
+def partition_sql(month):
+    return f"PARTITION p{month:%Y%m} VALUES LESS THAN ('{add_months(month, 1):%Y-%m-%d}')"
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+def add_months(month, n):
+    index = month.year * 12 + month.month - 1 + n
+    return date(index // 12, index % 12 + 1, 1)
+
+def month_range(first, last):
+    """Mois de first à last inclus."""
+    months = []
+    while first <= last:
+        months.append(first)
+        first = add_months(first, 1)
+    return months
+
+
+if __name__ == "__main__":
+    action = sys.argv[1] if len(sys.argv) > 1 else ""
+    if action == "activer":
+        enable_partitioning()
+    elif action == "maintenir":
+        maintain_partitions()
+    elif action == "archiver" and len(sys.argv) == 3:
+        year, month = sys.argv[2].split("-")
+        archive_partitions(date(int(year), int(month), 1))
+    else:
+        print("Usage : python3 scripts/partitions.py activer | maintenir | archiver AAAA-MM")
@@ -1,50 +1,47 @@
 import os
-import pandas as pd
-import mysql.connector
+import hashlib
 
 from datetime import datetime
 from commun import log_etl
-from commun import MYSQL_CONF
+from commun import db_connection
 from commun import DATA_STOCK
 from commun import DATA_LOG
+from commun import VIEWS_REFRESH
 from query_menu import query_menu
+from query_menu import run_sql
+from query_menu import warm_views
+from result_cache import bump_generation
+from metrics import stage
 
 # -- VUES SQL --
 
+# lit stock_courant (cumuls maintenus par load) : une ligne par produit, quel que soit l'historique
 SQL_V_STOCK = """
 CREATE OR REPLACE VIEW v_stock AS
 SELECT 
     p.id_src AS id_produit,
     p.nom    AS produit,
-    COALESCE(prod.total_prod, 0) AS total_prod,
-    COALESCE(cmd.total_cmds, 0)  AS total_cmds,
-    COALESCE(prod.total_prod, 0) - COALESCE(cmd.total_cmds, 0) AS stock
+    COALESCE(s.total_prod, 0) AS total_prod,
+    COALESCE(s.total_cmds, 0) AS total_cmds,
+    COALESCE(s.total_prod, 0) - COALESCE(s.total_cmds, 0) AS stock
 FROM produits AS p
-LEFT JOIN (
-    SELECT id_pdt, SUM(quantite) AS total_prod
-    FROM production
-    GROUP BY id_pdt
-) AS prod ON prod.id_pdt = p.id
-LEFT JOIN (
-    SELECT id_pdt, SUM(quantite) AS total_cmds
-    FROM lignes_cmd
-    GROUP BY id_pdt
-) AS cmd ON cmd.id_pdt = p.id
+LEFT JOIN stock_courant AS s ON s.id_pdt = p.id
 ORDER BY p.id_src;
 """
 
+# lisent le cube ventes_jour / commandes_jour (maintenu par load) ; la région
+# est celle actuelle du revendeur, comme avec la jointure sur les commandes
 SQL_V_ORDERS_BY_REGION = """
 CREATE OR REPLACE VIEW v_cmds_par_region AS
 SELECT 
     r.nom    AS region,
     p.id_src AS id_produit,
     p.nom    AS produit,
-    SUM(lc.quantite) AS total_commande
-FROM lignes_cmd lc
-JOIN commandes  c ON lc.id_cmd      = c.id
-JOIN revendeurs v ON c.id_revendeur = v.id
-JOIN regions    r ON v.id_region    = r.id
-JOIN produits   p ON lc.id_pdt      = p.id
+    SUM(vj.quantite) AS total_commande
+FROM ventes_jour vj
+JOIN revendeurs v ON vj.id_revendeur = v.id
+JOIN regions    r ON v.id_region     = r.id
+JOIN produits   p ON vj.id_pdt       = p.id
 GROUP BY r.nom, p.id_src, p.nom
 ORDER BY r.nom, p.id_src;
 """
@@ -54,46 +51,84 @@ CREATE OR REPLACE VIEW v_chiffre_affaires_par_region AS
 SELECT
     r.id  AS id_region,
     r.nom AS region,
-    ROUND(SUM(lc.quantite * lc.prix_unitaire), 2) AS chiffre_affaires,
-    COUNT(DISTINCT c.num_cmd) AS nb_commandes
-FROM lignes_cmd AS lc
-JOIN commandes  AS c  ON lc.id_cmd = c.id
-JOIN revendeurs AS re ON c.id_revendeur = re.id
-JOIN regions    AS r  ON re.id_region = r.id
-GROUP BY r.id, r.nom
+    ROUND(ca.chiffre_affaires, 2) AS chiffre_affaires,
+    nb.nb_commandes
+FROM regions AS r
+JOIN (
+    SELECT re.id_region, SUM(vj.chiffre_affaires) AS chiffre_affaires
+    FROM ventes_jour AS vj
+    JOIN revendeurs AS re ON vj.id_revendeur = re.id
+    GROUP BY re.id_region
+) AS ca ON ca.id_region = r.id
+JOIN (
+    SELECT re.id_region, SUM(cj.nb_commandes) AS nb_commandes
+    FROM commandes_jour AS cj
+    JOIN revendeurs AS re ON cj.id_revendeur = re.id
+    GROUP BY re.id_region
+) AS nb ON nb.id_region = r.id
 ORDER BY r.nom;
 """
 
+VIEWS = {
+    "v_stock": SQL_V_STOCK,
+    "v_cmds_par_region": SQL_V_ORDERS_BY_REGION,
+    "v_chiffre_affaires_par_region": SQL_V_SALES_BY_REGION,
+}
+
 #---------------
 # FONCTIONS
 #---------------
 
-def refresh_views():
-    """Créé ou recréé v_stock, v_cmds_par_region, v_chiffre_affaires_par_region."""
-    conn = mysql.connector.connect(**MYSQL_CONF)
-    try:
+def view_hash(sql):
+    return hashlib.sha256(" ".join(sql.split()).encode("utf-8")).hexdigest()
+
+def refresh_views(force=None):
+    """
+    Crée ou recrée v_stock, v_cmds_par_region, v_chiffre_affaires_par_region.
+    Seules les vues absentes ou dont la définition a changé (empreinte dans etl_vues)
+    sont recréées : pas de verrou de métadonnées pour les lecteurs du tableau de bord.
+    force=True (ou VIEWS_REFRESH="toujours") : DDL systématique.
+    """
+    if force is None:
+        force = VIEWS_REFRESH == "toujours"
+    with db_connection() as conn:
         cur = conn.cursor()
-        cur.execute(SQL_V_STOCK)
-        cur.execute(SQL_V_ORDERS_BY_REGION)
-        cur.execute(SQL_V_SALES_BY_REGION)
-        conn.commit()
-        print("[INFO] Vues (re)créées : v_stock, v_cmds_par_region, v_chiffre_affaires_par_region.")
-    except Exception as e:
-        conn.rollback()
-        print(f"[ERREUR] Création des vues : {e}")
-        raise
-    finally:
         try:
-            cur.close()
+            cur.execute("SELECT nom, empreinte FROM etl_vues")
+            known = dict(cur.fetchall())
+            cur.execute("SELECT table_name FROM information_schema.views WHERE table_schema = DATABASE()")
+            existing = {row[0] for row in cur.fetchall()}
+            changed = []
+            for name, sql in VIEWS.items():
+                digest = view_hash(sql)
+                if not force and name in existing and known.get(name) == digest:
+                    continue
+                cur.execute(sql)
+                cur.execute(
+                    "INSERT INTO etl_vues (nom, empreinte) VALUES (%s, %s) AS new "
+                    "ON DUPLICATE KEY UPDATE empreinte = new.empreinte",
+                    (name, digest)
+                )
+                changed.append(name)
+            if changed:
+                bump_generation(cur)
+            conn.commit()
+            if changed:
+                print(f"[INFO] Vues (re)créées : {', '.join(changed)}.")
+                log_etl("vues", "global", f"Vues (re)creees : {', '.join(changed)}", data_log=DATA_LOG)
+            else:
+                print("[INFO] Vues à jour, aucune DDL.")
+        except Exception as e:
+            conn.rollback()
+            print(f"[ERREUR] Création des vues : {e}")
+            raise
         finally:
-            conn.close()    
+            cur.close()
 
 def state_stocks():
     """
     Lit v_stock, affiche les alertes (stock < 0), exporte un CSV.
     """
-    conn = mysql.connector.connect(**MYSQL_CONF)   
-    cur = conn.cursor()
     query="""
             SELECT
                 id_produit,
@@ -104,19 +139,10 @@ def state_stocks():
             FROM v_stock;
         """
     try:
-        cur.execute(query)
-        rows = cur.fetchall()
-        cols = [d[0] for d in cur.description] if cur.description else []
-        df =pd.DataFrame(rows, columns=cols)
+        df = run_sql(query)
     except Exception as e :
         print(f"[ERREUR] Impossible de récupérer les données : {e}")
         raise
-    finally:
-        try:
-            cur.close()
-        except Exception:
-            pass
-        conn.close()
     # Alerte lisible
     negatives = df[df["stock"] < 0][["id_produit", "nom_produit", "stock"]]
     if not negatives.empty:
@@ -133,16 +159,27 @@ def state_stocks():
     df.to_csv(path, index=False, encoding="utf-8-sig", sep=";", decimal=",")
     print(f"\n[INFO] Export état des stocks terminé : {path}")
 
-def run_post_etl() :
+def run_post_etl(refresh=True, interactive=True) :
     """
     Refresh vues globales,création CSV, alertes stock
+    refresh=False : vues déjà à jour (mode démon, vues créées au démarrage),
+    de même avec VIEWS_REFRESH="migration" (vues vérifiées au démarrage de main_etl)
+    interactive=False : pas de tableau de bord en fin de traitement
+    Les vues standard sont pré-calculées pour la génération courante (cache partagé).
     """
     try:
-        refresh_views()
-        state_stocks()
+        if refresh and VIEWS_REFRESH != "migration":
+            with stage("post_etl.vues"):
+                refresh_views()
+        with stage("post_etl.etat_stock"):
+            state_stocks()
+        # premier affichage du tableau de bord servi depuis le cache
+        with stage("post_etl.cache") as m:
+            m["rows_in"] = len(warm_views())
         print("[OK] Fin ETL : vues à jour, CSV généré.")
         log_etl("post_etl", "global", "Vues mises a jour et CSV stock genere", data_log=DATA_LOG)
-        query_menu()
+        if interactive:
+            query_menu()
     
     except Exception as e:
         log_etl("erreur", "post_etl", f"Post-ETL interrompu : {e}", data_log=DATA_LOG)
\ No newline at end of file
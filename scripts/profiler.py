@@ -0,0 +1,124 @@
+import os
+import sys
+import cProfile
+import threading
+import tracemalloc
+
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from commun import log_etl
+from commun import DATA_LOG
+from commun import ETL_PROFILE
+
+#---------------
+# CONFIGURATION
+#---------------
+
+# Profilage des étapes de main_etl (--profile ou ETL_PROFILE=1) :
+#  ▪︎ <étape>.pstats           : cProfile (pstats / snakeviz)
+#  ▪︎ <étape>_allocations.txt  : principaux sites d'allocation (tracemalloc)
+#  ▪︎ <étape>.folded           : piles échantillonnées au format « collapsed » (flamegraph.pl, speedscope)
+# Désactivé, profile_stage se réduit à un test de booléen.
+PROFILE_DIR = DATA_LOG/"profil"
+SAMPLE_INTERVAL = 0.005
+TRACEMALLOC_FRAMES = 10
+TOP_ALLOCATIONS = 25
+
+state = {"enabled": ETL_PROFILE, "current": None, "sampler": None, "stop": None, "main_thread": None}
+profiles = {}        # étape -> cProfile.Profile (cumulé sur les appels)
+allocations = {}     # étape -> Counter(site -> octets alloués nets)
+stacks = {}          # étape -> Counter(pile repliée -> échantillons)
+
+#---------------
+# FONCTIONS
+#---------------
+
+def enable_profiling():
+    state["enabled"] = True
+
+def profiling_enabled():
+    return state["enabled"]
+
+@contextmanager
+def profile_stage(name):
+    if not state["enabled"]:
+        yield
+        return
+    start_sampler()
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+    profiler = profiles.setdefault(name, cProfile.Profile())
+    before = tracemalloc.take_snapshot()
+    previous, state["current"] = state["current"], name
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        state["current"] = previous
+        after = tracemalloc.take_snapshot()
+        sites = allocations.setdefault(name, Counter())
+        for diff in after.compare_to(before, "lineno"):
+            frame = diff.traceback[0]
+            sites[f"{frame.filename}:{frame.lineno}"] += diff.size_diff
+
+def profiled_iter(name, iterable):
+    """Profile chaque production d'élément d'un générateur (pages / paquets en mode flux)."""
+    iterator = iter(iterable)
+    while True:
+        with profile_stage(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+def start_sampler():
+    """Thread d'échantillonnage des piles du thread principal, attribuées à l'étape en cours."""
+    if state["sampler"] is not None:
+        return
+    state["main_thread"] = threading.main_thread().ident
+    state["stop"] = threading.Event()
+    state["sampler"] = threading.Thread(target=sample_stacks, name="etl-profiler", daemon=True)
+    state["sampler"].start()
+
+def sample_stacks():
+    while not state["stop"].wait(SAMPLE_INTERVAL):
+        name = state["current"]
+        if name is None:
+            continue
+        frame = sys._current_frames().get(state["main_thread"])
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            frames.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        if frames:
+            stacks.setdefault(name, Counter())[";".join(reversed(frames))] += 1
+
+def write_profiles():
+    """Écrit les fichiers de profil du run dans DATA_LOG/profil/<date>/ ; retourne le dossier."""
+    if not profiles:
+        return None
+    if state["sampler"] is not None:
+        state["stop"].set()
+        state["sampler"].join()
+        state["sampler"] = None
+    out_dir = PROFILE_DIR/datetime.now().strftime("%Y%m%d_%H%M%S")
+    os.makedirs(out_dir, exist_ok=True)
+    for name, profiler in profiles.items():
+        profiler.dump_stats(out_dir/f"{name}.pstats")
+        with open(out_dir/f"{name}_allocations.txt", "w") as f:
+            for site, size in allocations.get(name, Counter()).most_common(TOP_ALLOCATIONS):
+                f.write(f"{size / 1024:12.1f} Ko  {site}\n")
+        with open(out_dir/f"{name}.folded", "w") as f:
+            for stack, count in stacks.get(name, Counter()).items():
+                f.write(f"{stack} {count}\n")
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+    profiles.clear()
+    allocations.clear()
+    stacks.clear()
+    log_etl("profil", "main_etl", f"Profils ecrits dans {out_dir}", DATA_LOG)
+    return out_dir
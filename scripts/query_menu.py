@@ -1,11 +1,25 @@
 import os
 import pandas as pd
-import mysql.connector
 
 from dotenv import load_dotenv
 from datetime import datetime
-from commun import MYSQL_CONF
+from commun import db_connection
 from commun import DATA_STOCK
+from result_cache import cache_enabled
+from result_cache import read_generation
+from result_cache import get_result
+from result_cache import put_result
+
+# vues dont l'existence a été constatée par ce processus : une vue présente
+# n'est plus recherchée à chaque requête (menu, routes Flask)
+known_views = set()
+
+# requêtes des vues standard (choix 1, 3, 5 du menu et routes Flask), pré-calculées par run_post_etl
+VIEW_QUERIES = {
+    "v_stock": "SELECT * FROM v_stock;",
+    "v_cmds_par_region": "SELECT * FROM v_cmds_par_region;",
+    "v_chiffre_affaires_par_region": "SELECT * FROM v_chiffre_affaires_par_region;",
+}
 
 #---------------
 # FONCTIONS
@@ -22,7 +36,7 @@ def is_iso_date(input_date):
 
 def ask_period_build_where():
     """
-    Saisie + validation + normalisation + WHERE (sur c.date).
+    Saisie + validation + normalisation + WHERE (sur jour, colonne des tables du cube de ventes).
     Retour:
       (where_sql, title_tag, file_tag)  ou  None si erreur/saisie invalide.
     """
@@ -56,9 +70,9 @@ def ask_period_build_where():
     # WHERE
     parts = []
     if start_date:
-        parts.append(f"c.date >= '{start_date}'")
+        parts.append(f"jour >= '{start_date}'")
     if end_date:
-        parts.append(f"c.date <= '{end_date}'")
+        parts.append(f"jour <= '{end_date}'")
     if parts:
         where_sql = "WHERE " + " AND ".join(parts)
     else:
@@ -78,25 +92,59 @@ def ask_period_build_where():
     return where_sql, title_tag, file_tag
 
 def check_view_exists(view_name):
-    query = f"SHOW FULL TABLES WHERE Table_type = 'VIEW' AND Tables_in_{MYSQL_CONF['database']} = '{view_name}';"
-    df = run_sql(query)
-    return not df.empty
-
-def run_sql(query):
-    """Exécute un SELECT et retourne un DataFrame (sans pd.read_sql)."""
-    conn = mysql.connector.connect(**MYSQL_CONF)
-    cur = conn.cursor()
-    try:
-        cur.execute(query)
-        rows = cur.fetchall()
-        cols = [d[0] for d in cur.description] if cur.description else []
-        return pd.DataFrame(rows, columns=cols)
-    finally:
+    """Seule une absence est revérifiée : la vue peut être créée entre-temps par l'ETL."""
+    if view_name in known_views:
+        return True
+    df = run_sql(
+        "SELECT table_name FROM information_schema.views WHERE table_schema = DATABASE() AND table_name = %s;",
+        (view_name,), cache=False
+    )
+    if df.empty:
+        return False
+    known_views.add(view_name)
+    return True
+
+def run_sql(query, params=None, cache=True, persist=False):
+    """
+    Exécute un SELECT sur une connexion du pool et retourne un DataFrame (sans pd.read_sql).
+    cache=True : résultat servi depuis le cache tant que la génération des données n'a pas changé.
+    persist=True : requête toujours exécutée, résultat écrit dans le cache partagé (pré-calcul).
+    """
+    params = tuple(params) if params else None
+    cache = cache and cache_enabled()
+    with db_connection() as conn:
+        cur = conn.cursor()
         try:
-            cur.close()
-        except Exception:
-            pass
-        conn.close()
+            if cache:
+                # même instantané (lecture répétable) pour la génération et la requête
+                generation = read_generation(cur)
+                if not persist:
+                    df = get_result(generation, query, params)
+                    if df is not None:
+                        return df
+            cur.execute(query, params)
+            rows = cur.fetchall()
+            cols = [d[0] for d in cur.description] if cur.description else []
+            df = pd.DataFrame(rows, columns=cols)
+            if cache:
+                put_result(generation, query, params, df, persist=persist)
+            return df
+        finally:
+            try:
+                cur.close()
+            except Exception:
+                pass
+
+def warm_views():
+    """Pré-calcule les vues standard pour la génération courante ; retourne les vues traitées."""
+    if not cache_enabled():
+        return []
+    warmed = []
+    for name, query in VIEW_QUERIES.items():
+        if check_view_exists(name):
+            run_sql(query, persist=True)
+            warmed.append(name)
+    return warmed
 
 def display_df(df, title):
     if df is None:
@@ -142,34 +190,28 @@ def get_global_stock():
     if not check_view_exists("v_stock"):
         print(f"[ERREUR] La vue v_stock n'existe pas. Veuillez lancer l'ETL pour la créer.")
         return
-    return run_sql("SELECT * FROM v_stock;")
+    return run_sql(VIEW_QUERIES["v_stock"])
 
 def get_stock_at_date(target_date):
     """ menu choix 2 """
     if not is_iso_date(target_date):
         return
 
+    # journal de stock : dernier solde connu à la date, par produit (lecture indexée sur (id_pdt, jour))
     query_stock_at_date = f"""
         SELECT 
             p.id_src AS id_produit,
             p.nom    AS produit,
-            COALESCE(prod.total_prod, 0) AS total_prod,
-            COALESCE(cmd.total_cmds, 0)  AS total_cmds,
-            COALESCE(prod.total_prod, 0) - COALESCE(cmd.total_cmds, 0) AS stock
+            COALESCE(j.total_prod, 0) AS total_prod,
+            COALESCE(j.total_cmds, 0) AS total_cmds,
+            COALESCE(j.total_prod, 0) - COALESCE(j.total_cmds, 0) AS stock
         FROM produits AS p
-        LEFT JOIN (
-            SELECT id_pdt, SUM(quantite) AS total_prod
-            FROM production
-            WHERE date <= '{target_date}'
-            GROUP BY id_pdt
-        ) AS prod ON prod.id_pdt = p.id
-        LEFT JOIN (
-            SELECT lc.id_pdt, SUM(lc.quantite) AS total_cmds
-            FROM lignes_cmd AS lc
-            JOIN commandes AS c ON c.id = lc.id_cmd
-            WHERE c.date <= '{target_date}'
-            GROUP BY lc.id_pdt
-        ) AS cmd ON cmd.id_pdt = p.id
+        LEFT JOIN stock_journal AS j
+            ON j.id_pdt = p.id
+            AND j.jour = (
+                SELECT MAX(j2.jour) FROM stock_journal AS j2
+                WHERE j2.id_pdt = p.id AND j2.jour <= '{target_date}'
+            )
         ORDER BY p.id_src;
     """
     return run_sql(query_stock_at_date)
@@ -179,21 +221,21 @@ def get_orders_by_region():
     if not check_view_exists("v_cmds_par_region"):
         print(f"[ERREUR] La vue v_cmds_par_region n'existe pas. Veuillez lancer l'ETL pour la créer.")
         return
-    return run_sql("SELECT * FROM v_cmds_par_region;")
+    return run_sql(VIEW_QUERIES["v_cmds_par_region"])
 
 def get_orders_by_region_date(where_sql):
     """ menu choix 4 """
+    # cube ventes_jour : lecture par plage de jours sur la clé primaire
     query_orders = f"""
         SELECT 
             r.nom    AS region,
             p.id_src AS id_produit,
             p.nom    AS produit,
-            SUM(lc.quantite) AS total_commandes
-        FROM lignes_cmd lc
-        JOIN commandes  c ON lc.id_cmd      = c.id
-        JOIN revendeurs v ON c.id_revendeur = v.id
-        JOIN regions    r ON v.id_region    = r.id
-        JOIN produits   p ON lc.id_pdt      = p.id
+            SUM(vj.quantite) AS total_commandes
+        FROM ventes_jour vj
+        JOIN revendeurs v ON vj.id_revendeur = v.id
+        JOIN regions    r ON v.id_region     = r.id
+        JOIN produits   p ON vj.id_pdt       = p.id
         {where_sql}
         GROUP BY r.nom, p.id_src, p.nom
         ORDER BY r.nom, p.id_src;
@@ -205,21 +247,31 @@ def get_sales_by_region():
     if not check_view_exists("v_chiffre_affaires_par_region"):
         print(f"[ERREUR] La vue v_chiffre_affaires_par_region n'existe pas. Veuillez lancer l'ETL pour la créer.")
         return
-    return run_sql("SELECT * FROM v_chiffre_affaires_par_region;")
+    return run_sql(VIEW_QUERIES["v_chiffre_affaires_par_region"])
 
 def get_sales_by_region_date(where_sql):
     """ menu choix 6 """
+    # cube : chiffre d'affaires depuis ventes_jour, commandes distinctes depuis commandes_jour
     query_orders = f"""
         SELECT
             r.nom AS region,
-            ROUND(SUM(lc.quantite * lc.prix_unitaire), 2) AS total_chiffre_affaires,
-            COUNT(DISTINCT c.num_cmd) AS nb_commandes
-        FROM lignes_cmd lc
-        JOIN commandes  c  ON lc.id_cmd = c.id
-        JOIN revendeurs re ON c.id_revendeur = re.id
-        JOIN regions    r  ON re.id_region   = r.id
-        {where_sql}
-        GROUP BY r.nom
+            ROUND(ca.chiffre_affaires, 2) AS total_chiffre_affaires,
+            nb.nb_commandes
+        FROM regions r
+        JOIN (
+            SELECT re.id_region, SUM(vj.chiffre_affaires) AS chiffre_affaires
+            FROM ventes_jour vj
+            JOIN revendeurs re ON vj.id_revendeur = re.id
+            {where_sql}
+            GROUP BY re.id_region
+        ) AS ca ON ca.id_region = r.id
+        JOIN (
+            SELECT re.id_region, SUM(cj.nb_commandes) AS nb_commandes
+            FROM commandes_jour cj
+            JOIN revendeurs re ON cj.id_revendeur = re.id
+            {where_sql}
+            GROUP BY re.id_region
+        ) AS nb ON nb.id_region = r.id
         ORDER BY r.nom;
     """
     return run_sql(query_orders)
@@ -0,0 +1,62 @@
+from commun import db_connection
+from metrics import stage
+
+#---------------
+# CONFIGURATION
+#---------------
+
+# Cache des clés de référence de la base cible, valable pour un run ETL :
+# (table, colonne) -> set des valeurs présentes en base
+ref_keys = {}
+ref_stats = {"hits": 0, "misses": 0}
+
+#---------------
+# FONCTIONS
+#---------------
+
+def get_ref_keys(table, col):
+    """
+    Retourne les valeurs distinctes de table.col présentes en base cible.
+    Chaque couple (table, colonne) n'est lu qu'une fois par run.
+    """
+    key = (table, col)
+    if key in ref_keys:
+        ref_stats["hits"] += 1
+        return ref_keys[key]
+    ref_stats["misses"] += 1
+    ref_keys[key] = fetch_ref_keys(table, col)
+    return ref_keys[key]
+
+def add_ref_keys(table, col, values):
+    """Ajoute au cache les clés que load vient d'insérer (si le couple est déjà chargé)."""
+    key = (table, col)
+    if key in ref_keys:
+        ref_keys[key].update(values)
+
+def invalidate_ref_keys(table, col=None):
+    """Oublie une clé (ou toutes les colonnes d'une table) : relecture au prochain accès."""
+    for key in list(ref_keys):
+        if key[0] == table and (col is None or key[1] == col):
+            del ref_keys[key]
+
+def ref_cache_stats():
+    return dict(ref_stats, entries=len(ref_keys))
+
+def reset_ref_cache():
+    """Début de run : vide le cache et remet les compteurs à zéro."""
+    ref_keys.clear()
+    ref_stats["hits"] = 0
+    ref_stats["misses"] = 0
+
+def fetch_ref_keys(table, col):
+    """Lit toutes les valeurs distinctes de la colonne 'col' dans la table cible MySQL."""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            with stage("lookup.ref_keys", table) as m:
+                cursor.execute(f"SELECT DISTINCT {col} FROM {table}")
+                keys = {row[0] for row in cursor.fetchall()}
+                m["rows_out"] = len(keys)
+            return keys
+        finally:
+            cursor.close()
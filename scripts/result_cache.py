@@ -0,0 +1,109 @@
+import hashlib
+import threading
+import pandas as pd
+
+from collections import OrderedDict
+from commun import log_etl
+from commun import DATA_LOG
+from commun import RESULT_CACHE_MAX_MB
+
+#---------------
+# CONFIGURATION
+#---------------
+
+# Cache des résultats des requêtes du tableau de bord (menu, routes Flask).
+# Les données ne changent qu'à un chargement : load incrémente la génération
+# (table etl_generation, une ligne) dans la transaction des données, de même
+# que tout ce qui modifie les résultats du tableau de bord (recalcul des agrégats,
+# DDL des vues, archivage de partitions).
+# Une entrée n'est valable que pour la génération lue avant la requête :
+# au changement de génération, tout le cache est vidé.
+#  ▪︎ mémoire : LRU par (requête, paramètres), plafonné à RESULT_CACHE_MAX_MB (0 = désactivé)
+#  ▪︎ disque  : résultats pré-calculés par run_post_etl (vues standard), partagés entre
+#               processus (l'ETL les calcule, Flask et le menu les relisent)
+SQL_GENERATION = "SELECT generation FROM etl_generation WHERE id = 1"
+SQL_BUMP_GENERATION = """
+INSERT INTO etl_generation (id, generation) VALUES (1, 1)
+ON DUPLICATE KEY UPDATE generation = etl_generation.generation + 1;
+"""
+CACHE_DIR = DATA_LOG/"cache_requetes"
+MAX_BYTES = int(RESULT_CACHE_MAX_MB * 1024 * 1024)
+
+entries = OrderedDict()   # (requête, paramètres) -> (DataFrame, octets)
+cache_state = {"generation": None, "bytes": 0}
+cache_lock = threading.Lock()
+
+#---------------
+# FONCTIONS
+#---------------
+
+def cache_enabled():
+    return MAX_BYTES > 0
+
+def read_generation(cursor):
+    """Génération courante des données (0 : aucun chargement depuis la création de la base)."""
+    cursor.execute(SQL_GENERATION)
+    row = cursor.fetchone()
+    return int(row[0]) if row else 0
+
+def bump_generation(cursor):
+    """Nouvelle génération (sans commit : validée avec les changements qu'elle couvre)."""
+    cursor.execute(SQL_BUMP_GENERATION)
+
+def get_result(generation, query, params=None):
+    """Copie du résultat en cache pour cette génération (mémoire puis disque), sinon None."""
+    key = (query, params)
+    with cache_lock:
+        check_generation(generation)
+        if key in entries:
+            entries.move_to_end(key)
+            return entries[key][0].copy()
+    path = result_path(generation, key)
+    if not path.exists():
+        return None
+    try:
+        df = pd.read_parquet(path)
+    except Exception as e:
+        log_etl("cache_requetes", path.name, f"Fichier illisible, ignore : {e}", DATA_LOG)
+        return None
+    put_result(generation, query, params, df)
+    return df
+
+def put_result(generation, query, params, df, persist=False):
+    """Met en cache (LRU) ; persist=True : écrit aussi le fichier partagé de la génération."""
+    key = (query, params)
+    size = int(df.memory_usage(index=True, deep=True).sum())
+    with cache_lock:
+        check_generation(generation)
+        if key in entries:
+            cache_state["bytes"] -= entries.pop(key)[1]
+        if size <= MAX_BYTES:
+            entries[key] = (df.copy(), size)
+            cache_state["bytes"] += size
+            while cache_state["bytes"] > MAX_BYTES:
+                _, (_, evicted) = entries.popitem(last=False)
+                cache_state["bytes"] -= evicted
+    if persist:
+        write_result(generation, key, df)
+
+def check_generation(generation):
+    """Appelé sous cache_lock : nouvelle génération -> toutes les entrées sont périmées."""
+    if cache_state["generation"] != generation:
+        entries.clear()
+        cache_state["bytes"] = 0
+        cache_state["generation"] = generation
+
+def result_path(generation, key):
+    digest = hashlib.sha256(repr(key).encode("utf-8")).hexdigest()[:24]
+    return CACHE_DIR/f"{generation}_{digest}.parquet"
+
+def write_result(generation, key, df):
+    """Écriture atomique ; les fichiers des générations précédentes sont supprimés."""
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    path = result_path(generation, key)
+    tmp = path.with_suffix(".tmp")
+    df.to_parquet(tmp, index=False)
+    tmp.replace(path)
+    for old in CACHE_DIR.glob("*.parquet"):
+        if not old.name.startswith(f"{generation}_"):
+            old.unlink(missing_ok=True)
@@ -1,10 +1,12 @@
 import pandas as pd
-import mysql.connector
 
 from commun import log_etl
-from commun import MYSQL_CONF
+from commun import log_etl_many
 from commun import DATA_LOG
 from commun import SCHEMA_COLUMNS
+from ref_cache import get_ref_keys
+from cmd_index import find_existing_num_cmd
+from metrics import stage
 
 #---------------
 # CONFIGURATION
@@ -37,171 +39,197 @@ SCHEMA_FK = {
         "revendeurs": [("id_region", "regions", "id")]
     }
 
-def transform(dict_data):
+TRACKING_COLUMNS = ["source_file", "source_idx"]
+REJECT_COLUMNS = ["source_file", "source_idx", "rule", "column"]
+REJECT_MESSAGES = {
+    "format":           "Ligne {idx} : valeurs NaN apres correction dans '{col}'",
+    "valeur_interdite": "Ligne {idx} rejetee (valeur interdite)",
+    "doublon":          "Ligne {idx} supprimee (doublon sur {col})",
+    "doublon_bdd":      "Ligne {idx} supprimee (cle deja presente en base sur {col})",
+    "doublon strict":   "Ligne {idx} strictement identique supprimee",
+    "entete_incoherente": "Ligne {idx} rejetee (date ou revendeur different pour le meme {col})",
+    "cle_etrangere":    "Ligne {idx} rejetee ({col} absent de {ref})",
+}
+
+def transform(dict_data, upsert=False):
     """
     Transforme chaque DataFrame du dict_data selon les règles définies par l'organigramme.
-    Retourne dict_transform (clé: nom table, valeur: DataFrame nettoyé)
+    Chaque règle produit un masque de rejet ; les lignes rejetées sont collectées
+    dans un DataFrame (source_file, source_idx, rule, column) journalisé en une fois.
+    upsert=True (changements CDC) : une clé déjà en base est une mise à jour, pas un doublon.
+    Retourne dict_transform (clé: nom table, valeur: DataFrame nettoyé) et les rejets par table.
     """
 
     dict_transformed = {}
-    rejected_rows = {table: set() for table in dict_data.keys()}
+    rejects = []
+    added_columns = {}
 
     for table, df in dict_data.items():
         if df.empty:
             continue
 
+        # 0. Colonnes de suivi (fichier et ligne d'origine) pour tracer les rejets
+        added_columns[table] = [col for col in TRACKING_COLUMNS if col not in df.columns]
+        if "source_file" not in df.columns:
+            df["source_file"] = table
+        if "source_idx" not in df.columns:
+            df["source_idx"] = df.index
+
         # 1. Nettoyage préliminaire (espace, minuscule)
         date_columns, numeric_columns = SCHEMA_COLUMN_TYPES.get(table, ([], []))
-        text_cols = [col for col in df.select_dtypes(include="object").columns
-             if col not in date_columns + numeric_columns]
-        for col in text_cols:
-            df[col] = df[col].astype(str).str.strip().str.lower()
+        with stage("transform.nettoyage", table, rows_in=len(df)):
+            text_cols = [col for col in df.select_dtypes(include="object").columns
+                 if col not in date_columns + numeric_columns + TRACKING_COLUMNS]
+            for col in text_cols:
+                df[col] = df[col].astype(str).str.strip().str.lower()
 
         # 2. Vérification structure (colonnes attendus)
         expected_columns = SCHEMA_COLUMNS.get(table, set())
         if not expected_columns.issubset(df.columns):
             log_etl("structure", table, f"Colonnes manquantes: {sorted(expected_columns - set(df.columns))}",DATA_LOG)
-            rejected_rows[table].update(df.index)
+            reject(df, pd.Series(True, index=df.index), table, "structure", None, rejects)
             continue
-       
-        # 3. Correction de format (dates, num)
-        for col in date_columns:
-            df[col] = pd.to_datetime(df[col], format="%Y-%m-%d",errors='coerce') #NaN sur erreur
-        for col in numeric_columns:
-            df[col] = pd.to_numeric(df[col], errors='coerce')
-        # Log si correction (si valeur manquante ou conversion en échec)
-        for col in date_columns + numeric_columns:
-            nerr = df[col].isna().sum()
-            if nerr:
-                for idx in df[df[col].isna()].index:
-                    source_file,source_idx = get_source_info(df, idx, table)
-                    log_etl("format", source_file, f"Ligne {source_idx} : valeurs NaN apres correction dans '{col}'",DATA_LOG)
-                    rejected_rows[table].add(idx)
-                    
+
+        # 3. Correction de format (dates, num) : NaN si valeur manquante ou conversion en échec
+        with stage("transform.format", table, rows_in=len(df)) as m:
+            for col in date_columns:
+                df[col] = pd.to_datetime(df[col], format="%Y-%m-%d",errors='coerce') #NaN sur erreur
+            for col in numeric_columns:
+                df[col] = pd.to_numeric(df[col], errors='coerce')
+            for col in date_columns + numeric_columns:
+                df = reject(df, df[col].isna(), table, "format", col, rejects)
+            m["rows_out"] = len(df)
+
         # 4. Vérification valeurs interdites
-        rejected_idx = set()
-        # valeur négative
-        for col in numeric_columns:
-            rejected_idx.update(df.index[df[col] < 0].tolist())
-        # données vides
-        required_columns = SCHEMA_REQUIRED_COLUMNS.get(table, set())
-        for col in required_columns:
-            rejected_idx.update(df.index[df[col].isna()].tolist())
-        # date > date du jour
-        for col in date_columns:
-            if col in df.columns:
-                rejected_idx.update(df.index[df[col] > pd.Timestamp.today()].tolist())
-        #log
-        for idx in rejected_idx:
-            source_file,source_idx = get_source_info(df, idx, table)
-            log_etl("valeur_interdite", source_file, f"Ligne {source_idx} rejetee (valeur interdite)",DATA_LOG)
-            rejected_rows[table].add(idx)
-        df = df.drop(index=rejected_idx)
-        
+        with stage("transform.valeur_interdite", table, rows_in=len(df)) as m:
+            # valeur négative
+            for col in numeric_columns:
+                df = reject(df, df[col] < 0, table, "valeur_interdite", col, rejects)
+            # données vides
+            for col in sorted(SCHEMA_REQUIRED_COLUMNS.get(table, set())):
+                df = reject(df, df[col].isna(), table, "valeur_interdite", col, rejects)
+            # date > date du jour
+            for col in date_columns:
+                df = reject(df, df[col] > pd.Timestamp.today(), table, "valeur_interdite", col, rejects)
+            m["rows_out"] = len(df)
 
         # 5. Détection et suppression de doublons dans le df et en base
         unique_key = SCHEMA_PK.get(table)
         if unique_key is not None:
             if table != "commandes" and unique_key in df.columns:
-                n_dups = df.duplicated(subset=unique_key, keep='first').sum()
-                if n_dups > 0:
-                    idx_dups = df[df.duplicated(subset=unique_key, keep='first')].index
-                    for idx in idx_dups:
-                        source_file,source_idx = get_source_info(df, idx, table)
-                        log_etl("doublon", source_file, f"Ligne {source_idx} supprimee (doublon sur {unique_key})")
-                        rejected_rows[table].add(idx)
-                    df = df.drop_duplicates(subset=unique_key, keep='first')
-            db_keys = get_ref_value_from_db(MYSQL_CONF, table, unique_key)
-            idx_bdd = df[df[unique_key].isin(db_keys)].index
-            if len(idx_bdd) > 0:
-                for idx in idx_bdd:
-                    source_file,source_idx = get_source_info(df, idx, table)
-                    log_etl("doublon_bdd", source_file, f"Ligne {source_idx} supprimee (cle deja presente en base sur {unique_key})")
-                    rejected_rows[table].add(idx)
-                df = df.drop(index=idx_bdd).reset_index(drop=True)
-                
-
-        #5bis. suppresion des lignes strictement identique 
-        cols_without_source = [c for c in df.columns if c not in ("source_file", "source_idx")]
-        duplicated_mask = df.duplicated(subset=cols_without_source, keep='first')
-        idx_duplicated = df[duplicated_mask].index
-        for idx in idx_duplicated:
-            source_file, source_idx = get_source_info(df, idx, table)
-            log_etl("doublon strict", source_file, f"Ligne {source_idx} strictement identique supprimee", DATA_LOG)
-            rejected_rows[table].add(idx)
-        df = df.drop_duplicates(subset=cols_without_source, keep='first')
-
-        # 6. Retirer lignes KO
-        df = df.reset_index(drop=True)
+                with stage("transform.doublon", table, rows_in=len(df)) as m:
+                    df = reject(df, df.duplicated(subset=unique_key, keep='first'), table, "doublon", unique_key, rejects)
+                    m["rows_out"] = len(df)
+            with stage("transform.doublon_bdd", table, rows_in=len(df)) as m:
+                if upsert:
+                    db_keys = set()
+                elif table == "commandes":
+                    # index local : seuls les num_cmd du lot sont vérifiés en base
+                    db_keys = find_existing_num_cmd(df[unique_key].unique())
+                else:
+                    db_keys = get_ref_keys(table, unique_key)
+                df = reject(df, df[unique_key].isin(db_keys), table, "doublon_bdd", unique_key, rejects)
+                m["rows_out"] = len(df)
+
+        #5bis. suppresion des lignes strictement identique
+        with stage("transform.doublon_strict", table, rows_in=len(df)) as m:
+            cols_without_source = [c for c in df.columns if c not in TRACKING_COLUMNS]
+            df = reject(df, df.duplicated(subset=cols_without_source, keep='first'), table, "doublon strict", None, rejects)
+            m["rows_out"] = len(df)
+
+        #5ter. une commande = un en-tête : lignes d'un num_cmd déjà vu avec une autre date ou un autre revendeur
+        if table == "commandes":
+            with stage("transform.entete_incoherente", table, rows_in=len(df)) as m:
+                first = df.groupby("num_cmd")[["date", "id_revendeur"]].transform("first")
+                conflict = (df["date"] != first["date"]) | (df["id_revendeur"] != first["id_revendeur"])
+                df = reject(df, conflict, table, "entete_incoherente", "num_cmd", rejects)
+                m["rows_out"] = len(df)
+
         dict_transformed[table] = df
-    
-    #7.Vérification des FK
+
+    #6.Vérification des FK
     for table, df in dict_transformed.items():
         fk_checks = SCHEMA_FK.get(table, [])
         for col, ref, ref_col in fk_checks:
             if col not in df.columns:
                 continue
-
-            local_values=set()
             # Valeurs autorisées presente dans le df ou bddcible
             if ref in dict_transformed and ref_col in dict_transformed[ref].columns:
-                local_values=set(dict_transformed[ref][ref_col])
+                local_values = set(dict_transformed[ref][ref_col])
             else:
-                local_values=set()
-            db_values = get_ref_value_from_db(MYSQL_CONF, ref, ref_col)
-            valid_values = local_values.union(db_values)
-            if col in df.columns :
-                rejected_idx_fk=~df[col].isin(valid_values)
-                if rejected_idx_fk.any():
-                    for idx in df[rejected_idx_fk].index:
-                        source_file, source_idx = get_source_info(df, idx, table)
-                        log_etl("cle_etrangere", source_file,f"Ligne {source_idx} rejetee ({col} absent de {ref})",DATA_LOG)
-                        rejected_rows[table].add(source_idx)
-                    df=df[~rejected_idx_fk].reset_index(drop=True)
-                    
-
-        # MAJ DataFrame après FK
-        if "source_idx" in df.columns:
-            dict_transformed[table] = df.drop(columns=["source_idx"])
+                local_values = set()
+            with stage("transform.cle_etrangere", table, rows_in=len(df)) as m:
+                valid_values = local_values.union(get_ref_keys(ref, ref_col))
+                df = reject(df, ~df[col].isin(valid_values), table, "cle_etrangere", col, rejects, ref=ref)
+                m["rows_out"] = len(df)
+        dict_transformed[table] = df
+
+    #7. Retirer les colonnes de suivi ajoutées + journalisation groupée des rejets
+    for table, df in dict_transformed.items():
+        drop_cols = ["source_idx"] + [c for c in added_columns[table] if c != "source_idx"]
+        dict_transformed[table] = df.drop(columns=drop_cols).reset_index(drop=True)
+
+    if rejects:
+        df_rejects = pd.concat(rejects, ignore_index=True)
+    else:
+        df_rejects = pd.DataFrame(columns=["table"] + REJECT_COLUMNS)
+    log_rejects(df_rejects)
+    rejected_rows = {
+        table: df_rejects.loc[df_rejects["table"] == table, REJECT_COLUMNS].reset_index(drop=True)
+        for table in dict_data.keys()
+    }
     return dict_transformed,rejected_rows
 
 #----------
 # fonction
 #----------
 
-def get_ref_value_from_db(mysql_conf, table, col):
+def reject(df, mask, table, rule, column, rejects, ref=None):
     """
-    Récupère toutes les valeurs distinctes de la colonne 'col' dans la table cible MySQL.
+    Ajoute à 'rejects' les lignes de df désignées par le masque booléen
+    et retourne df sans ces lignes (une ligne n'est rejetée qu'une fois).
     """
-    conn = mysql.connector.connect(**mysql_conf)
-    try:
-        query = f"SELECT DISTINCT {col} FROM {table}"
-        cursor = conn.cursor()
-        cursor.execute(query)
-        rows = cursor.fetchall()  # Liste de tuples
-        values = set()
-        for row in rows:
-            value = row[0]
-            values.add(value)
-        return values
-    finally:
-        conn.close()
-
-def get_source_info(df, idx, table):
-    if "source_file" in df.columns:
-        try:
-            source_file = df.at[idx, "source_file"]
-        except Exception:
-            source_file = table
-    else:
-        source_file = table
-
-    # Récupère l'index source (ligne d'origine)
-    if "source_idx" in df.columns:
-        try:
-            source_idx = df.at[idx, "source_idx"]
-        except Exception:
-            source_idx = idx
-    else:
-        source_idx = idx
-    return source_file, source_idx
\ No newline at end of file
+    mask = mask.fillna(False).astype(bool)
+    if not mask.any():
+        return df
+    bad = df.loc[mask]
+    rejects.append(pd.DataFrame({
+        "table":       table,
+        "source_file": bad["source_file"].values,
+        "source_idx":  bad["source_idx"].values,
+        "rule":        rule,
+        "column":      column,
+        "ref":         ref,
+    }))
+    return df.loc[~mask]
+
+def log_rejects(df_rejects):
+    """Journalise tous les rejets en une seule écriture (la structure est déjà tracée par table)."""
+    df_log = df_rejects[df_rejects["rule"] != "structure"]
+    if df_log.empty:
+        return
+    messages = [
+        REJECT_MESSAGES[rule].format(idx=idx, col=col, ref=ref)
+        for rule, idx, col, ref in zip(df_log["rule"], df_log["source_idx"], df_log["column"], df_log["ref"])
+    ]
+    log_etl_many(pd.DataFrame({
+        "type_evenement": df_log["rule"].values,
+        "source":         df_log["source_file"].values,
+        "message":        messages,
+    }), DATA_LOG)
+
+def drop_loaded_keys(dict_transformed):
+    """
+    Reprise d'un run : retire des référentiels les clés chargées entre-temps
+    (chargement interrompu après le commit d'une table). Commandes et production
+    passent par le staging et n'insèrent déjà que les clés absentes.
+    """
+    for table, df in dict_transformed.items():
+        unique_key = SCHEMA_PK.get(table)
+        if table in ("commandes", "production") or unique_key not in df.columns:
+            continue
+        mask = df[unique_key].isin(get_ref_keys(table, unique_key))
+        if mask.any():
+            log_etl("reprise", table, f"{int(mask.sum())} ligne(s) deja chargee(s) ecartee(s)", DATA_LOG)
+            dict_transformed[table] = df.loc[~mask].reset_index(drop=True)
+    return dict_transformed
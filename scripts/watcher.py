@@ -0,0 +1,70 @@
+import os
+import time
+
+try:
+    from inotify_simple import INotify, flags  # Linux uniquement
+except ImportError:
+    INotify = None
+
+#---------------
+# FONCTIONS
+#---------------
+
+def is_candidate(name):
+    return name.lower().endswith(".csv") and not name.startswith(".")
+
+class FolderWatcher:
+    """
+    Surveillance d'un dossier de dépôt : inotify (fin d'écriture / déplacement)
+    quand il est disponible, sinon scrutation périodique. Un fichier n'est signalé
+    qu'une fois complet (fermé en écriture, ou taille/mtime stables entre deux scans).
+    """
+
+    def __init__(self, folder, poll_interval=1.0):
+        self.folder = str(folder)
+        self.poll_interval = poll_interval
+        self.last_stats = {}
+        self.inotify = None
+        if INotify is not None:
+            try:
+                self.inotify = INotify()
+                self.inotify.add_watch(self.folder, flags.CLOSE_WRITE | flags.MOVED_TO)
+            except OSError:
+                self.inotify = None
+
+    @property
+    def mode(self):
+        return "inotify" if self.inotify is not None else "scrutation"
+
+    def existing_files(self):
+        """Fichiers déjà présents au démarrage (déposés pendant l'arrêt du démon)."""
+        try:
+            return sorted(f for f in os.listdir(self.folder) if is_candidate(f))
+        except FileNotFoundError:
+            return []
+
+    def wait(self, timeout):
+        """Attend au plus 'timeout' secondes et retourne les fichiers devenus prêts."""
+        if self.inotify is not None:
+            events = self.inotify.read(timeout=int(timeout * 1000))
+            return sorted({e.name for e in events if is_candidate(e.name)})
+        time.sleep(min(timeout, self.poll_interval))
+        return self.poll()
+
+    def poll(self):
+        ready = []
+        current = {}
+        for name in self.existing_files():
+            try:
+                stat = os.stat(os.path.join(self.folder, name))
+            except FileNotFoundError:
+                continue
+            current[name] = (stat.st_size, stat.st_mtime_ns)
+            if self.last_stats.get(name) == current[name]:
+                ready.append(name)
+        self.last_stats = {name: st for name, st in current.items() if name not in ready}
+        return ready
+
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()
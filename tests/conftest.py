@@ -0,0 +1,16 @@
+import os
+import sys
+import tempfile
+
+from pathlib import Path
+
+# scripts/ importés comme à l'exécution (python3 scripts/main_etl.py) ;
+# chemins de données dans un dossier temporaire, base MySQL non requise
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT/"scripts"))
+
+TMP = Path(tempfile.mkdtemp(prefix="distributech_tests_"))
+for name in ("DATA_IN", "DATA_TREATED", "DATA_LOG", "DATA_STOCK"):
+    os.environ.setdefault(name, str(TMP/name.lower()))
+    Path(os.environ[name]).mkdir(parents=True, exist_ok=True)
+os.environ.setdefault("SQLITE_DB_PATH", str(TMP/"base_stock.sqlite"))
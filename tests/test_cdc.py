@@ -0,0 +1,99 @@
+import sqlite3
+
+import cdc
+import load
+
+from cdc import CDC_WATERMARK
+
+
+class FakeCursor:
+    """Curseur MySQL simulé : seules les écritures de etl_watermarks sont interprétées."""
+
+    def __init__(self, watermarks):
+        self.watermarks = watermarks
+
+    def execute(self, query, params=None):
+        if "etl_watermarks" not in query:
+            return
+        table, last_id = params
+        if "GREATEST" in query:
+            last_id = max(self.watermarks.get(table, 0), last_id)
+        self.watermarks[table] = last_id
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, watermarks):
+        self.watermarks = watermarks
+
+    def cursor(self):
+        return FakeCursor(self.watermarks)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+def create_source(path, nb_regions):
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute("CREATE TABLE region (region_id INTEGER PRIMARY KEY, region_name TEXT)")
+        conn.execute("CREATE TABLE revendeur (revendeur_id INTEGER PRIMARY KEY, revendeur_name TEXT, region_id INTEGER)")
+        conn.execute("CREATE TABLE produit (product_id INTEGER PRIMARY KEY, product_name TEXT, cout_unitaire REAL)")
+        add_regions(conn, 1, nb_regions)
+    conn.close()
+
+
+def add_regions(conn, first, last):
+    conn.executemany("INSERT INTO region VALUES (?, ?)", [(i, f"region {i}") for i in range(first, last + 1)])
+
+
+def sync(path, watermarks):
+    """read_changes puis apply_changes (filigrane seul), comme sync_references."""
+    changes, last_seq = cdc.read_changes(path, cdc.DATA_LOG)
+    if last_seq is not None:
+        load.apply_changes({}, {}, last_seq, conn=FakeConnection(watermarks))
+    df, _ = changes.get("region", (None, []))
+    return sorted(df["region_id"]) if df is not None else []
+
+
+def test_changelog_recreated_twice(tmp_path, monkeypatch):
+    path = tmp_path/"source.sqlite"
+    watermarks = {}
+    monkeypatch.setattr(cdc, "get_watermarks", lambda data_log: dict(watermarks))
+    # base cible injoignable au moment de la réinstallation : filigrane non remis à zéro
+    monkeypatch.setattr(cdc, "reset_watermark", lambda *args: None)
+
+    create_source(path, 6)
+    cdc.install_cdc(path)
+    assert sync(path, watermarks) == [1, 2, 3, 4, 5, 6]
+    assert watermarks[CDC_WATERMARK] == 6
+
+    # 1re recréation : journal réamorcé avec 2 lignes, séquence sous l'ancien filigrane
+    cdc.uninstall_cdc(path)
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute("DELETE FROM region WHERE region_id > 2")
+    conn.close()
+    cdc.install_cdc(path)
+    assert sync(path, watermarks) == [1, 2]
+    assert watermarks[CDC_WATERMARK] == 2
+
+    # 2e recréation : journal vide, puis des changements au-delà de l'ancien filigrane
+    cdc.uninstall_cdc(path)
+    cdc.install_cdc(path, seed=False)
+    assert sync(path, watermarks) == []
+    assert watermarks[CDC_WATERMARK] == 0
+
+    conn = sqlite3.connect(path)
+    with conn:
+        add_regions(conn, 3, 10)
+    conn.close()
+    # seq 1..8 : aucun changement sauté
+    assert sync(path, watermarks) == [3, 4, 5, 6, 7, 8, 9, 10]
+    assert watermarks[CDC_WATERMARK] == 8
+    assert sync(path, watermarks) == []